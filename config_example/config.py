@@ -8,6 +8,17 @@
 STARTPAGE = "startpage"
 # Activate content management system (view)
 # CMS_MODE = True
+# Store older page versions as delta to the next newer version (see "manage.py convert_history" for existing versions)
+# HISTORY_DELTA = True
+# Every n-th page version is stored completely, if HISTORY_DELTA is active
+# HISTORY_KEYFRAME_INTERVAL = 20
+# Search backend: "whoosh" (index in data/whoosh) or "fts5" (SQLite FTS5 table in the database, updated with every page
+# save). Run "manage.py rebuild_index" after changing it.
+# SEARCH_BACKEND = "whoosh"
+# Update the search index in a background thread after page changes (False: update within the request)
+# SEARCH_INDEX_ASYNC = True
+# Seconds to wait for further changes, before the background thread updates the search index
+# SEARCH_INDEX_DELAY = 2
 
 #
 # Users library
@@ -71,3 +82,7 @@ ADMINS = [("Piki", EMAIL_FROM), ]
 
 # This might be needed for usage in a docker environment
 # CSRF_TRUSTED_ORIGINS = ['<YOUR_SERVER_URL>', ]
+
+# This defines the session storage. With 'django.contrib.sessions.backends.cached_db' sessions are read from a file cache
+# instead of the database for most requests.
+# SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
@@ -34,6 +34,13 @@ def get_search_query(request):
     return request.GET.get('q')
 
 
+def get_int_param(request, key, default):
+    try:
+        return int(request.GET.get(key, default))
+    except ValueError:
+        return default
+
+
 def timestamp_to_datetime(request, tm):
     from users.models import get_userprofile
     #
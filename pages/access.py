@@ -1,21 +1,101 @@
 from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
 import logging
 import os
 
-from .models import PikiPage
+from .cache import page_cache
+from .models import get_page
 
 logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
 
 
+PROFILE_KEY = "permission-profile-%d"
+
+
+def permission_profile(request):
+    # Permission relevant user data, cached per user and stored on the request
+    try:
+        return request.piki_permission_profile
+    except AttributeError:
+        pass
+    user = request.user
+    if user.is_authenticated:
+        profile = page_cache().get(PROFILE_KEY % user.id)
+        if profile is None:
+            profile = {
+                "id": user.id,
+                "is_superuser": user.is_superuser,
+                "is_staff": user.is_staff,
+                "group_ids": frozenset(user.groups.values_list("id", flat=True)),
+            }
+            page_cache().set(PROFILE_KEY % user.id, profile)
+    else:
+        profile = {
+            "id": None,
+            "is_superuser": False,
+            "is_staff": False,
+            "group_ids": frozenset(),
+        }
+    request.piki_permission_profile = profile
+    return profile
+
+
+def invalidate_permission_profiles(user_ids):
+    page_cache().delete_many([PROFILE_KEY % user_id for user_id in user_ids])
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_permission_profiles([instance.id])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # groups of a user changed
+        if action.startswith("post_"):
+            invalidate_permission_profiles([instance.id])
+    elif action in ["post_add", "post_remove"]:
+        # users of a group changed
+        invalidate_permission_profiles(pk_set)
+    elif action == "pre_clear":
+        invalidate_permission_profiles(instance.user_set.values_list("id", flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    invalidate_permission_profiles(instance.user_set.values_list("id", flat=True))
+
+
+def readable_pages(request, pages):
+    # Restrict the queryset pages to the pages readable by the user (same rules as access_control.may_read)
+    profile = permission_profile(request)
+    if profile["is_superuser"]:
+        return pages
+    readable = Q(other_perms_read=True) | Q(group_id__in=profile["group_ids"], group_perms_read=True)
+    if profile["id"] is not None:
+        readable |= Q(owner_id=profile["id"], owner_perms_read=True)
+    return pages.filter(readable)
+
+
+def readable_by(profile, owner_id, group_id, owner_perms_read, group_perms_read, other_perms_read):
+    # The read rules of access_control for already loaded page data
+    if profile["is_superuser"] or other_perms_read:
+        return True
+    if profile["id"] is not None and owner_id == profile["id"] and owner_perms_read:
+        return True
+    return group_id in profile["group_ids"] and group_perms_read
+
+
 class access_control(object):
     def __init__(self, request, rel_path):
         self._request = request
         self._rel_path = rel_path
-        self._user = request.user
-        try:
-            self._page = PikiPage.objects.get(rel_path=rel_path)
-        except PikiPage.DoesNotExist:
-            self._page = None
+        self._profile = permission_profile(request)
+        self._page = get_page(request, rel_path)
         self._read = None
         self._write = None
 
@@ -24,13 +104,13 @@ class access_control(object):
             self._read = False
             self._write = False
             #
-            if self._user.is_superuser:
+            if self._profile["is_superuser"]:
                 # A superuser has full access
                 logger.debug("User is superuser -> full access granted")
                 self._read = True
                 self._write = True
             elif self._page is None:
-                if self._user.is_staff:
+                if self._profile["is_staff"]:
                     # Page creation is allowed for staff users
                     logger.debug("Page %s does not exist and user is staff -> full access granted", repr(self._rel_path))
                     self._read = True
@@ -38,8 +118,8 @@ class access_control(object):
                 else:
                     logger.debug("Page %s does not exist and user is not staff -> no access granted", repr(self._rel_path))
             else:
-                user_is_owner = self._page.owner == self._user
-                user_in_page_group = self._page.group in self._user.groups.all()
+                user_is_owner = self._profile["id"] is not None and self._page.owner_id == self._profile["id"]
+                user_in_page_group = self._page.group_id in self._profile["group_ids"]
                 # read permissions
                 if user_is_owner and self._page.owner_perms_read:
                     logger.debug("Read access granted, due to owner permissions of page")
@@ -76,13 +156,31 @@ class access_control(object):
         return self.may_write()
 
 
+def directory_access(request, rel_path):
+    # access_control of a page directory, created once per directory and request
+    try:
+        request_access = request.piki_attachment_access
+    except AttributeError:
+        request_access = request.piki_attachment_access = {}
+    if rel_path not in request_access:
+        request_access[rel_path] = access_control(request, rel_path)
+    return request_access[rel_path]
+
+
+def attachment_access(request, path):
+    rel_path = os.path.dirname(path)
+    # the rendered output depends on the access to this directory (see PikiPage.render_text)
+    log = getattr(request, "piki_attachment_log", None)
+    if log is not None:
+        log.add(rel_path)
+    return directory_access(request, rel_path)
+
+
 def read_attachment(request, path):
     # Interface for external module mycreole
-    rel_path = os.path.dirname(path)
-    return access_control(request, rel_path).may_read_attachment()
+    return attachment_access(request, path).may_read_attachment()
 
 
 def modify_attachment(request, path):
     # Interface for external module mycreole
-    rel_path = os.path.dirname(path)
-    return access_control(request, rel_path).may_modify_attachment()
+    return attachment_access(request, path).may_modify_attachment()
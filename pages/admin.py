@@ -1,6 +1,7 @@
 from django.contrib import admin
 from simple_history.admin import SimpleHistoryAdmin
 
+from . import cache
 from .models import PikiPage
 from .forms import GroupForm, PermForm
 
@@ -9,6 +10,14 @@ from django.http import HttpResponseRedirect
 from django.contrib.auth.models import Group
 
 
+def update_pages(queryset, **values):
+    # queryset.update bypasses PikiPage.save, the caches of the pages and their listings are invalidated here
+    pages = list(queryset.values_list("id", "rel_path"))
+    queryset.update(**values)
+    cache.invalidate_ids([page_id for page_id, rel_path in pages])
+    cache.invalidate_dependents([rel_path for page_id, rel_path in pages])
+
+
 class PikiPageAdmin(SimpleHistoryAdmin):
     list_display = ('rel_path', 'tags', 'group', 'other_perms_read', 'other_perms_write')
     history_list_display = ('rel_path', 'tags', 'deleted')
@@ -23,7 +32,7 @@ class PikiPageAdmin(SimpleHistoryAdmin):
 
     @admin.action(description="Remove access for others")
     def remove_access_others(self, request, query_set):
-        query_set.update(other_perms_read=False, other_perms_write=False)
+        update_pages(query_set, other_perms_read=False, other_perms_write=False)
 
     @admin.action(description="Set group for pages")
     def set_group(self, request, queryset):
@@ -32,7 +41,7 @@ class PikiPageAdmin(SimpleHistoryAdmin):
                 group = Group.objects.get(id=request.POST.get("group"))
             else:
                 group = None
-            queryset.update(group=group)
+            update_pages(queryset, group=group)
             self.message_user(request, "Changed group for {} pages".format(queryset.count()))
             return HttpResponseRedirect(request.get_full_path())
         return render(request, 'admin/set_group.html', context={'pages': queryset, 'form': GroupForm()})
@@ -42,7 +51,7 @@ class PikiPageAdmin(SimpleHistoryAdmin):
         if 'apply' in request.POST:
             keys = ["owner_perms_read", "owner_perms_write", "group_perms_read", "group_perms_write", "other_perms_read", "other_perms_write"]
             perms = {key: key in request.POST for key in keys}
-            queryset.update(**perms)
+            update_pages(queryset, **perms)
             self.message_user(request, "Changed permissions for {} pages".format(queryset.count()))
             return HttpResponseRedirect(request.get_full_path())
         return render(request, 'admin/set_perms.html', context={'pages': queryset, 'form': PermForm()})
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pages'
+
+    def ready(self):
+        # register signal handlers
+        from . import access  # noqa: F401
+        from . import autocomplete  # noqa: F401
+        from . import search  # noqa: F401
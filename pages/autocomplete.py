@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+import bisect
+import logging
+import threading
+
+from . import cache
+from .access import permission_profile, readable_by
+from .models import ListingChange, PikiPage
+
+logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
+
+# Default and maximum number of suggestions
+AUTOCOMPLETE_SIZE = 10
+AUTOCOMPLETE_MAX_SIZE = 50
+# rel_path and the arguments of access.readable_by
+INDEX_FIELDS = ["rel_path", "owner_id", "group_id", "owner_perms_read", "group_perms_read", "other_perms_read"]
+
+_index_lock = threading.Lock()
+_index = None
+
+
+class path_index(object):
+    # Sorted arrays of the lower case paths and titles of all available pages with their read permissions. The index
+    # belongs to a listing token of the pages cache. If the token changes (in any process), the changes logged in
+    # ListingChange since the last look are applied.
+    def __init__(self, token):
+        self.build(token)
+
+    def build(self, token):
+        self.token = token
+        # the newest change before reading the pages, later changes are applied by update
+        self.last_id = ListingChange.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        self.perms = {}
+        self.paths = []
+        self.titles = []
+        for row in PikiPage.objects.filter(deleted=False).values_list(*INDEX_FIELDS):
+            self.perms[row[0]] = row[1:]
+        self.paths = sorted(self.path_key(rel_path) for rel_path in self.perms)
+        self.titles = sorted(self.title_key(rel_path) for rel_path in self.perms)
+        logger.debug('Autocomplete index built for %d pages.', len(self.perms))
+
+    def update(self, token):
+        changes = list(ListingChange.objects.filter(id__gte=self.last_id).order_by("id").values_list("id", "rel_path"))
+        # the last seen change (or the first change at all) has to be in the log, otherwise it was pruned in the meantime
+        if len(changes) > 0 and changes[0][0] == self.last_id:
+            changes = changes[1:]
+        elif self.last_id > 0 or (len(changes) > 0 and changes[0][0] != 1):
+            self.build(token)
+            return
+        self.token = token
+        if len(changes) == 0:
+            return
+        self.last_id = changes[-1][0]
+        rel_paths = set(rel_path for change_id, rel_path in changes)
+        for rel_path in rel_paths:
+            if self.perms.pop(rel_path, None) is not None:
+                self.paths.pop(bisect.bisect_left(self.paths, self.path_key(rel_path)))
+                self.titles.pop(bisect.bisect_left(self.titles, self.title_key(rel_path)))
+        for row in PikiPage.objects.filter(rel_path__in=rel_paths, deleted=False).values_list(*INDEX_FIELDS):
+            self.perms[row[0]] = row[1:]
+            bisect.insort(self.paths, self.path_key(row[0]))
+            bisect.insort(self.titles, self.title_key(row[0]))
+        logger.debug('Autocomplete index updated for %d changed pages.', len(rel_paths))
+
+    def path_key(self, rel_path):
+        return (rel_path.lower(), rel_path)
+
+    def title_key(self, rel_path):
+        return (rel_path.split("/")[-1].lower(), rel_path.lower(), rel_path)
+
+    def complete(self, profile, prefix, size=AUTOCOMPLETE_SIZE):
+        # Readable pages with a path starting with prefix, followed by the pages with a title starting with prefix
+        prefix = prefix.lower()
+        rv = []
+        for rel_path in self.__matches(prefix):
+            if len(rv) >= size:
+                break
+            if rel_path not in rv and readable_by(profile, *self.perms[rel_path]):
+                rv.append(rel_path)
+        return rv
+
+    def __matches(self, prefix):
+        pos = bisect.bisect_left(self.paths, (prefix, ))
+        while pos < len(self.paths) and self.paths[pos][0].startswith(prefix):
+            yield self.paths[pos][-1]
+            pos += 1
+        pos = bisect.bisect_left(self.titles, (prefix, ))
+        while pos < len(self.titles) and self.titles[pos][0].startswith(prefix):
+            yield self.titles[pos][-1]
+            pos += 1
+
+
+def get_index():
+    global _index
+    token = cache.listing_token()
+    with _index_lock:
+        if _index is None:
+            _index = path_index(token)
+        elif _index.token != token:
+            _index.update(token)
+        return _index
+
+
+def complete(request, prefix, size=AUTOCOMPLETE_SIZE):
+    return get_index().complete(permission_profile(request), prefix, size)
+
+
+@receiver(post_delete, sender=PikiPage)
+def page_deleted(sender, instance, **kwargs):
+    # PikiPage.save covers changes, removed database rows (e.g. in the admin area) need to be handled here
+    cache.invalidate_dependents([instance.rel_path])
@@ -0,0 +1,290 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+import hashlib
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
+
+CACHE_NAME = "pages"
+BLOCK_CACHE_NAME = "blocks"
+SEARCH_CACHE_NAME = "search"
+# Maximum number of permission variants stored for a single page
+MAX_VARIANTS = 8
+
+RENDER_KEY = "render-%d"
+META_KEY = "meta-%d"
+HISTORY_KEY = "history-%d-%d"
+DIFF_KEY = "diff-%d-%d-%s"
+# changes with every change of the available or readable pages
+LISTING_TOKEN_KEY = "listing-token"
+# Number of entries kept in the ListingChange log
+LISTING_CHANGES_KEPT = 1000
+# Seconds a search result stays valid, if it depends on the current time (relative dates)
+SEARCH_RELATIVE_TIMEOUT = 60
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+}
+
+
+def page_cache():
+    return caches[CACHE_NAME]
+
+
+def stats():
+    return dict(_stats)
+
+
+def permission_class(request):
+    from .access import permission_profile
+    #
+    profile = permission_profile(request)
+    if profile["is_superuser"]:
+        return "superuser"
+    elif profile["id"] is not None:
+        # the groups are part of the class, page listings depend on them
+        return "user-%d-%s" % (profile["id"], ",".join(str(group_id) for group_id in sorted(profile["group_ids"])))
+    return "anonymous"
+
+
+def attachment_state(rel_path):
+    # changes with every added, removed or replaced attachment of the page rel_path (stored by mycreole)
+    try:
+        with os.scandir(os.path.join(settings.MYCREOLE_ROOT, rel_path)) as entries:
+            files = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.is_file())
+    except OSError:
+        return ""
+    return hashlib.sha1(repr(files).encode("utf-8")).hexdigest()
+
+
+def render_class(request, dirs):
+    # The effective permission class for rendering: the attachment access of the user to the page directories used by
+    # the creole text (dirs) and the attachments available there
+    from .access import directory_access, permission_profile
+    #
+    profile = permission_profile(request)
+    if profile["is_superuser"]:
+        rv = ["superuser"]
+    elif profile["id"] is not None:
+        rv = ["user"]
+    else:
+        rv = ["anonymous"]
+    for rel_path in sorted(dirs):
+        acc = directory_access(request, rel_path)
+        rv.append("%s:%d%d:%s" % (rel_path, acc.may_read_attachment(), acc.may_modify_attachment(), attachment_state(rel_path)))
+    return "\n".join(rv)
+
+
+def render_variant(request, entry):
+    variant = render_class(request, entry["dirs"])
+    if entry["listing"]:
+        # the page listings depend on the groups and the owned pages of the user
+        variant = permission_class(request) + "\n" + variant
+    return variant
+
+
+def count(hit, what, key):
+    _stats["hits" if hit else "misses"] += 1
+    logger.debug("Render cache %s for %s %s (hits=%d, misses=%d)", "hit" if hit else "miss", what, repr(key), _stats["hits"], _stats["misses"])
+
+
+def add_variant(variants, variant, html):
+    variants.pop(variant, None)
+    while len(variants) >= MAX_VARIANTS:
+        # drop the oldest variant
+        variants.pop(next(iter(variants)))
+    variants[variant] = html
+
+
+def get_variant(key, page, variant):
+    if page.id is None:
+        return None
+    entry = page_cache().get(key % page.id)
+    html = None
+    if entry is not None and entry["modified_time"] == page.modified_time:
+        html = entry["html"].get(variant)
+    count(html is not None, repr(variant) + " of page", page.rel_path)
+    return html
+
+
+def set_variant(key, page, variant, html):
+    if page.id is None:
+        return
+    entry = page_cache().get(key % page.id)
+    if entry is None or entry["modified_time"] != page.modified_time:
+        entry = {"modified_time": page.modified_time, "html": {}}
+    add_variant(entry["html"], variant, html)
+    page_cache().set(key % page.id, entry)
+
+
+def get_output(key, request, modified_time=None):
+    # rendered creole text, stored with the page directories used while rendering
+    entry = page_cache().get(key)
+    html = None
+    if entry is not None and entry["modified_time"] == modified_time and "dirs" in entry:
+        html = entry["html"].get(render_variant(request, entry))
+    count(html is not None, "rendered text", key)
+    return html
+
+
+def set_output(key, request, html, dirs, listing, modified_time=None, timeout=DEFAULT_TIMEOUT):
+    dirs = sorted(dirs)
+    entry = page_cache().get(key)
+    if entry is None or entry["modified_time"] != modified_time or entry.get("dirs") != dirs or entry.get("listing") != listing:
+        entry = {"modified_time": modified_time, "dirs": dirs, "listing": listing, "html": {}}
+    add_variant(entry["html"], render_variant(request, entry), html)
+    page_cache().set(key, entry, timeout)
+
+
+def get_rendered(page, request):
+    if page.id is None:
+        return None
+    return get_output(RENDER_KEY % page.id, request, page.modified_time)
+
+
+def set_rendered(page, request, html, dependencies=None, dirs=(), token=None):
+    # token is the listing token at the start of rendering
+    if page.id is not None:
+        set_dependencies(page, dependencies)
+        set_output(RENDER_KEY % page.id, request, html, dirs, bool(dependencies), page.modified_time)
+        if dependencies and token != listing_token():
+            # the listed pages changed while rendering
+            page_cache().delete(RENDER_KEY % page.id)
+
+
+def get_meta(page, variant):
+    # The meta page only depends on the variant (including the timezone of the user), not on the permissions
+    return get_variant(META_KEY, page, variant)
+
+
+def set_meta(page, variant, html):
+    set_variant(META_KEY, page, variant, html)
+
+
+def get_history(page, request, history_id):
+    # A historical version never changes, the entry is valid forever
+    return get_output(HISTORY_KEY % (page.id, history_id), request)
+
+
+def set_history(page, request, history_id, html, dirs=()):
+    set_output(HISTORY_KEY % (page.id, history_id), request, html, dirs, False, timeout=None)
+
+
+def get_diff(left_history_id, right_history_id, mode):
+    if left_history_id is None:
+        return None
+    return page_cache().get(DIFF_KEY % (left_history_id, right_history_id, mode))
+
+
+def set_diff(left_history_id, right_history_id, mode, html):
+    # The diff of two versions never changes
+    if left_history_id is not None:
+        page_cache().set(DIFF_KEY % (left_history_id, right_history_id, mode), html, timeout=None)
+
+
+def set_dependencies(page, dependencies):
+    from .models import RenderDependency
+    #
+    dependencies = set(dependencies or [])
+    stored = set(RenderDependency.objects.filter(page_id=page.id).values_list("filter_str", flat=True))
+    if stored != dependencies:
+        RenderDependency.objects.filter(page_id=page.id, filter_str__in=stored - dependencies).delete()
+        RenderDependency.objects.bulk_create(
+            [RenderDependency(page_id=page.id, filter_str=filter_str) for filter_str in dependencies - stored], ignore_conflicts=True
+        )
+
+
+def invalidate(page):
+    if page.id is not None:
+        logger.debug("Render cache invalidated for page %s", repr(page.rel_path))
+        page_cache().delete_many([RENDER_KEY % page.id, META_KEY % page.id])
+
+
+def invalidate_ids(page_ids):
+    # pages changed without PikiPage.save (e.g. queryset.update)
+    page_cache().delete_many([key % page_id for page_id in page_ids for key in [RENDER_KEY, META_KEY]])
+
+
+def invalidate_dependents(rel_paths):
+    from .models import ListingChange
+    #
+    if len(rel_paths) == 0:
+        return
+    changes = ListingChange.objects.bulk_create([ListingChange(rel_path=rel_path) for rel_path in set(rel_paths)])
+    last_id = changes[-1].id if changes[-1].id is not None else ListingChange.objects.latest("id").id
+    ListingChange.objects.filter(id__lte=last_id - LISTING_CHANGES_KEPT).delete()
+    invalidate_listings(rel_paths)
+    # again after the commit, a page rendered in the meantime might show the state before the change
+    transaction.on_commit(lambda: invalidate_listings(rel_paths))
+
+
+def invalidate_listings(rel_paths):
+    from .models import RenderDependency
+    #
+    # cached search results are keyed by the listing token
+    renew_listing_token()
+    filter_strs = [
+        filter_str for filter_str in RenderDependency.objects.values_list("filter_str", flat=True).distinct()
+        if any(rel_path.startswith(filter_str) for rel_path in rel_paths)
+    ]
+    if len(filter_strs) > 0:
+        page_ids = set(RenderDependency.objects.filter(filter_str__in=filter_strs).values_list("page_id", flat=True))
+        logger.debug("Render cache invalidated for %d dependent pages of %s", len(page_ids), repr(rel_paths))
+        page_cache().delete_many([RENDER_KEY % page_id for page_id in page_ids])
+
+
+def block_key(request, rel_path, block):
+    data = "\n".join([render_class(request, [rel_path]), rel_path, block])
+    return "block-" + hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def get_blocks(keys):
+    return caches[BLOCK_CACHE_NAME].get_many(keys)
+
+
+def set_blocks(data):
+    caches[BLOCK_CACHE_NAME].set_many(data)
+
+
+def token(key):
+    value = page_cache().get(key)
+    if value is None:
+        value = renew_token(key)
+    return value
+
+
+def renew_token(key):
+    # A new random token instead of a counter, the cache might have been cleared in the meantime
+    value = uuid.uuid4().hex
+    page_cache().set(key, value, timeout=None)
+    return value
+
+
+def listing_token():
+    return token(LISTING_TOKEN_KEY)
+
+
+def renew_listing_token():
+    return renew_token(LISTING_TOKEN_KEY)
+
+
+def search_key(request, search_txt, index_version, page_num, page_size):
+    data = repr((search_txt, permission_class(request), index_version, listing_token(), page_num, page_size))
+    return "search-" + hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def get_search(key):
+    return caches[SEARCH_CACHE_NAME].get(key)
+
+
+def set_search(key, result, relative=False):
+    if relative:
+        caches[SEARCH_CACHE_NAME].set(key, result, timeout=SEARCH_RELATIVE_TIMEOUT)
+    else:
+        caches[SEARCH_CACHE_NAME].set(key, result)
@@ -0,0 +1,177 @@
+import bisect
+import difflib
+from html import escape
+
+DIFF_TABLE = "table"
+DIFF_UNIFIED = "unified"
+DIFF_MODES = [DIFF_TABLE, DIFF_UNIFIED]
+
+# Number of unchanged lines shown around a change
+CONTEXT_LINES = 3
+
+NO_CHANGES = "<p>No Differences Found</p>\n"
+
+# Regions without unique common lines larger than this (lines left * lines right) are shown as replaced completely,
+# the effort of comparing them line by line grows quadratically
+FALLBACK_MAX_SIZE = 1000 * 1000
+
+
+class patience_matcher(difflib.SequenceMatcher):
+    # Line based patience diff. Lines are compared by their hash, regions without unique common lines are compared by the
+    # standard SequenceMatcher.
+    def __init__(self, a, b):
+        ids = {}
+        self.__a_ids = [ids.setdefault(line, len(ids)) for line in a]
+        self.__b_ids = [ids.setdefault(line, len(ids)) for line in b]
+        super().__init__(None, a, b, autojunk=False)
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is None:
+            matches = []
+            self.__patience(0, len(self.a), 0, len(self.b), matches)
+            # join matching lines to blocks
+            blocks = []
+            for i, j in matches:
+                if len(blocks) > 0 and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+                    blocks[-1][2] += 1
+                else:
+                    blocks.append([i, j, 1])
+            blocks.append([len(self.a), len(self.b), 0])
+            self.matching_blocks = [difflib.Match(*block) for block in blocks]
+        return self.matching_blocks
+
+    def __patience(self, alo, ahi, blo, bhi, matches):
+        a = self.__a_ids
+        b = self.__b_ids
+        # Work stack of ranges (alo, ahi, blo, bhi) and matches (i, j) in reverse order. Unique lines can be nested
+        # thousands of levels deep, which would exceed the recursion limit.
+        stack = [(alo, ahi, blo, bhi)]
+        while len(stack) > 0:
+            item = stack.pop()
+            if len(item) == 2:
+                matches.append(item)
+                continue
+            alo, ahi, blo, bhi = item
+            # common head and tail (the tail in reverse order)
+            while alo < ahi and blo < bhi and a[alo] == b[blo]:
+                matches.append((alo, blo))
+                alo += 1
+                blo += 1
+            while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+                ahi -= 1
+                bhi -= 1
+                stack.append((ahi, bhi))
+            if alo < ahi and blo < bhi:
+                anchors = self.__unique_anchors(alo, ahi, blo, bhi)
+                if len(anchors) == 0:
+                    if (ahi - alo) * (bhi - blo) <= FALLBACK_MAX_SIZE:
+                        # frequent lines (e.g. empty lines) are ignored as junk in larger regions
+                        sm = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi])
+                        for i, j, n in sm.get_matching_blocks():
+                            matches.extend((alo + i + k, blo + j + k) for k in range(n))
+                else:
+                    work = []
+                    for i, j in anchors:
+                        work.append((alo, i, blo, j))
+                        work.append((i, j))
+                        alo = i + 1
+                        blo = j + 1
+                    work.append((alo, ahi, blo, bhi))
+                    stack.extend(reversed(work))
+
+    def __unique_anchors(self, alo, ahi, blo, bhi):
+        # lines which are unique in both ranges
+        counts = {}
+        for i in range(alo, ahi):
+            entry = counts.setdefault(self.__a_ids[i], [0, i, 0, None])
+            entry[0] += 1
+        for j in range(blo, bhi):
+            entry = counts.get(self.__b_ids[j])
+            if entry is not None:
+                entry[2] += 1
+                entry[3] = j
+        pairs = sorted((entry[1], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[2] == 1)
+        # longest increasing subsequence of the b indexes (patience sorting)
+        piles = []
+        tops = []
+        back = {}
+        for i, j in pairs:
+            pos = bisect.bisect_left(tops, j)
+            back[(i, j)] = piles[pos - 1][-1] if pos > 0 else None
+            if pos == len(piles):
+                piles.append([(i, j)])
+                tops.append(j)
+            else:
+                piles[pos].append((i, j))
+                tops[pos] = j
+        anchors = []
+        node = piles[-1][-1] if len(piles) > 0 else None
+        while node is not None:
+            anchors.append(node)
+            node = back[node]
+        anchors.reverse()
+        return anchors
+
+
+def get_diff_mode(request):
+    mode = request.GET.get("diff", DIFF_TABLE)
+    return mode if mode in DIFF_MODES else DIFF_TABLE
+
+
+def has_changes(sm):
+    return any(tag != "equal" for tag, i1, i2, j1, j2 in sm.get_opcodes())
+
+
+def html_table(left_lines, right_lines, left_title, right_title, context=CONTEXT_LINES):
+    sm = patience_matcher(left_lines, right_lines)
+    if not has_changes(sm):
+        return NO_CHANGES
+    rv = '<table class="diff">\n'
+    rv += f'<thead><tr><th class="diff_next" colspan="2">{escape(left_title)}</th>'
+    rv += f'<th class="diff_next" colspan="2">{escape(right_title)}</th></tr></thead>\n'
+    rv += '<tbody>\n'
+    for group in sm.get_grouped_opcodes(context):
+        rv += '<tr><td class="diff_next" colspan="4">...</td></tr>\n'
+        for tag, i1, i2, j1, j2 in group:
+            for k in range(max(i2 - i1, j2 - j1)):
+                left = _html_cell(left_lines, i1 + k, i2, "diff_sub" if tag != "equal" else None)
+                right = _html_cell(right_lines, j1 + k, j2, "diff_add" if tag != "equal" else None)
+                rv += f'<tr>{left}{right}</tr>\n'
+    rv += '</tbody>\n</table>\n'
+    return rv
+
+
+def _html_cell(lines, index, end, css_class):
+    if index >= end:
+        return '<td class="diff_header"></td><td></td>'
+    line = escape(lines[index])
+    if css_class is not None:
+        line = f'<span class="{css_class}">{line}</span>'
+    return f'<td class="diff_header">{index + 1}</td><td nowrap="nowrap">{line}</td>'
+
+
+def unified(left_lines, right_lines, left_title, right_title, context=CONTEXT_LINES):
+    sm = patience_matcher(left_lines, right_lines)
+    if not has_changes(sm):
+        return NO_CHANGES
+    rv = f"--- {left_title}\n+++ {right_title}\n"
+    for group in sm.get_grouped_opcodes(context):
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        rv += f"@@ -{_unified_range(i1, i2)} +{_unified_range(j1, j2)} @@\n"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                rv += "".join(" " + line + "\n" for line in left_lines[i1:i2])
+            else:
+                rv += "".join("-" + line + "\n" for line in left_lines[i1:i2])
+                rv += "".join("+" + line + "\n" for line in right_lines[j1:j2])
+    return '<pre class="diff">\n' + escape(rv) + '</pre>\n'
+
+
+def _unified_range(start, stop):
+    # range of a hunk header like difflib.unified_diff ("start,0" is the line before an empty range)
+    length = stop - start
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
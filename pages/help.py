@@ -68,6 +68,7 @@ without giving special search commands in the search string.
 * creation_time (DATETIME)
 * modified_time (DATETIME)
 * modified_user (TEXT)
+* path (KEYWORD): The page path and all parent paths, e.g. //path:team/ops// finds //team/ops// and all its subpages.
 
 == Search syntax (Whoosh)
 === Logic operators
@@ -82,11 +83,13 @@ A search pattern like //foo:bar// does look for //bar// in the field named //foo
 
 This search pattern can also be combined with other search text via logical operators.
 === Search for specific content
-* **Wildcards:**
-* **Range:**
-** From To:
-** Above:
-** Below:
+* **Wildcards:** //*// matches any number of characters, //?// exactly one character of a word.
+** **Example:** "fo?bar" finds //foobar// and //fo7bar//, "proj*" finds all words starting with //proj//.
+* **Range:** Ranges are supported for the date fields //creation_time// and //modified_time//.
+** From To: "modified_time:[20240101 to 20240301]"
+** Above: "modified_time:[20240101 to]"
+** Below: "modified_time:[to 20240301]"
+** Ranges over text fields (e.g. //title:[apple to bear]//) are only supported by the Whoosh search backend.
 * **Named constants:**
 ** //now//: Current date
 ** //-[num]y//: Current date minus [num] years
@@ -98,6 +101,7 @@ This search pattern can also be combined with other search text via logical oper
 * [[/search/?q=modified_user:system-page|modified_user:system-page]] results in a list of all system pages.
 * [[/search/?q=modified_time%3A%5B-5d+to+now%5D| modified_time:[-5d to now] ]] results in a list of all pages which have been modified within the last 5 days.
 * [[/search/?q=tag%3Afoo| tag:foo ]] results in a list of all pages which are tagged with //foo//.
+* [[/search/?q=foo&path=bar| /search/?q=foo&path=bar ]] results in a list of all pages in //bar// and its subpages which contain //foo//.
 """))
 
 BACKUP = mycreole.render_simple(_(
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from pages.models import PikiPage
+from pages.storage import convert_history
+
+
+class Command(BaseCommand):
+    help = "Convert the stored page history to reverse delta or to complete storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Store all versions completely (default: reverse deltas with keyframes)")
+
+    def handle(self, *args, **options):
+        n = 0
+        for page in PikiPage.objects.only("id", "rel_path").iterator():
+            n += convert_history(page, not options["full"])
+        self.stdout.write(self.style.SUCCESS('%d page versions converted.') % n)
@@ -1,9 +1,42 @@
 from django.core.management.base import BaseCommand
-from pages.search import create_index, rebuild_index
+from pages.search import create_index, index_drift, load_index, rebuild_index, schema_outdated, sync_index
+
+import time
 
 
 class Command(BaseCommand):
+    help = "Create the search index and add all pages, or synchronise an existing index with the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--procs", type=int, default=1, help="Number of indexing processes of a full rebuild (default: 1, each process uses up to --limitmb)")
+        parser.add_argument("--limitmb", type=int, default=128, help="Memory limit in MB for each indexing process")
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument("--incremental", action="store_true", help="Only add, update or remove the documents which differ from the database")
+        mode.add_argument("--check", action="store_true", help="Report the differences between index and database without changing the index")
+
     def handle(self, *args, **options):
+        tm = time.time()
+        if options["incremental"] or options["check"]:
+            ix = load_index(upgrade=False)
+            if schema_outdated(ix):
+                if options["check"]:
+                    self.stdout.write(self.style.WARNING('Search index has an outdated schema, a full rebuild is needed.'))
+                    return
+                self.stdout.write(self.style.WARNING('Search index has an outdated schema, doing a full rebuild.'))
+            else:
+                added, updated, removed = index_drift(ix)
+                for label, rel_paths in [("missing", added), ("outdated", updated), ("obsolete", removed)]:
+                    for rel_path in rel_paths:
+                        self.stdout.write('%s: %s' % (label, rel_path))
+                if options["incremental"]:
+                    sync_index(ix, added, updated, removed)
+                    action = "synchronised"
+                else:
+                    action = "checked"
+                self.stdout.write(self.style.SUCCESS('Search index %s in %.1fs (%d missing, %d outdated, %d obsolete).') % (
+                    action, time.time() - tm, len(added), len(updated), len(removed)))
+                return
         ix = create_index()
-        n = rebuild_index(ix)
-        self.stdout.write(self.style.SUCCESS('Search index for %d items created.') % n)
+        n = rebuild_index(ix, procs=max(options["procs"], 1), limitmb=options["limitmb"])
+        tm = time.time() - tm
+        self.stdout.write(self.style.SUCCESS('Search index for %d items created in %.1fs (%.1f items/s).') % (n, tm, n / tm))
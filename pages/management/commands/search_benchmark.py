@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from datetime import datetime, timedelta
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from zoneinfo import ZoneInfo
+
+from pages.models import PikiPage
+from pages.search import parse_query, whoosh_backend
+from pages.search_fts import fts5_backend
+
+
+class Command(BaseCommand):
+    help = "Compare indexing throughput and query latency of the search backends on a synthetic corpus. " \
+           "The benchmark runs on a throwaway test database and index, the wiki data is not touched."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=2000, help="Number of synthetic pages")
+        parser.add_argument("--words", type=int, default=300, help="Number of words per synthetic page")
+        parser.add_argument("--queries", type=int, default=200, help="Number of queries per backend")
+        parser.add_argument("--procs", type=int, default=1, help="Number of indexing processes for Whoosh")
+        parser.add_argument("--seed", type=int, default=1, help="Seed of the random corpus and queries")
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options["seed"])
+        # word frequencies following Zipf's law
+        vocabulary = ["%s%d" % (rnd.choice(["al", "be", "ga", "de", "ep", "ze"]), i) for i in range(5000)]
+        weights = [1 / (i + 1) for i in range(len(vocabulary))]
+        tags = ["tag%d" % i for i in range(20)]
+        dtm = datetime.now(tz=ZoneInfo("UTC"))
+        pages = [
+            PikiPage(
+                rel_path="benchmark/%d/%d" % (i % 50, i),
+                page_txt=" ".join(rnd.choices(vocabulary, weights, k=options["words"])),
+                tags=rnd.choice(tags),
+                creation_time=dtm - timedelta(days=rnd.randint(0, 365)),
+                modified_time=dtm - timedelta(days=rnd.randint(0, 365)),
+            ) for i in range(options["pages"])
+        ]
+        queries = []
+        for i in range(options["queries"]):
+            word, other = rnd.choices(vocabulary, weights, k=2)
+            queries.append(rnd.choice([
+                word,
+                rnd.choice(vocabulary),
+                f"{word} {other}",
+                f"{word} OR {other}",
+                f"{word[:3]}*",
+                f"tag:{rnd.choice(tags)}",
+                f"{word} modified_time:[-30d to now]",
+            ]))
+        #
+        db_name = connection.settings_dict["NAME"]
+        # the same test database Django creates for the tests (incl. the FTS5 table), removed afterwards
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        path = tempfile.mkdtemp()
+        try:
+            PikiPage.objects.bulk_create(pages, batch_size=500)
+            for backend in [whoosh_backend(path=path), fts5_backend()]:
+                self.run_backend(backend, queries, options["procs"])
+        finally:
+            connection.creation.destroy_test_db(db_name, verbosity=0)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def run_backend(self, backend, queries, procs):
+        tm = time.perf_counter()
+        ix = backend.create_index()
+        n = backend.rebuild_index(ix, procs=procs)
+        tm = time.perf_counter() - tm
+        latencies = []
+        hits = 0
+        for search_txt in queries:
+            q = parse_query(search_txt)
+            start = time.perf_counter()
+            results = backend.search(ix, q, 25) or []
+            for rel_path, hit in results:
+                backend.highlights(ix, hit)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(results)
+        latencies.sort()
+        self.stdout.write(self.style.SUCCESS(
+            "%-6s: %d pages indexed in %.2fs (%.0f pages/s), %d queries: mean %.2fms, median %.2fms, p95 %.2fms, %d hits" % (
+                backend.name, n, tm, n / tm, len(latencies), statistics.mean(latencies), statistics.median(latencies),
+                latencies[int(len(latencies) * 0.95)], hits
+            )
+        ))
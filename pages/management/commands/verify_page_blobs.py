@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pages.models import PikiPage, PikiPageBlob
+from pages.storage import blob_digest, blob_page_txt
+
+
+class Command(BaseCommand):
+    help = "Verify the content addressed page text storage."
+
+    def handle(self, *args, **options):
+        errors = 0
+        referenced = set()
+        # blobs
+        digests = list(PikiPageBlob.objects.values_list("digest", flat=True))
+        for digest in digests:
+            try:
+                page_txt = blob_page_txt(digest)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR("Blob %s can not be read: %s" % (digest, e)))
+                errors += 1
+            else:
+                if blob_digest(page_txt) != digest:
+                    self.stdout.write(self.style.ERROR("Blob %s does not match its digest" % digest))
+                    errors += 1
+        digests = set(digests)
+        referenced.update(PikiPageBlob.objects.filter(base__isnull=False).values_list("base", flat=True))
+        # pages
+        for rel_path, page_txt, digest in PikiPage.objects.values_list("rel_path", "page_txt", "page_blob").iterator():
+            referenced.add(digest)
+            if digest is None or blob_digest(page_txt) != digest:
+                self.stdout.write(self.style.ERROR("Page %s does not reference its text" % repr(rel_path)))
+                errors += 1
+        # history
+        for rel_path, history_id, digest in PikiPage.history.values_list("rel_path", "history_id", "page_blob").iterator():
+            referenced.add(digest)
+            if digest is not None and digest not in digests:
+                self.stdout.write(self.style.ERROR("Version %d of page %s references a missing blob" % (history_id, repr(rel_path))))
+                errors += 1
+        #
+        unreferenced = len(digests - referenced)
+        if unreferenced > 0:
+            self.stdout.write(self.style.WARNING("%d blobs are not referenced" % unreferenced))
+        if errors > 0:
+            raise CommandError("%d errors found in the page text storage." % errors)
+        self.stdout.write(self.style.SUCCESS("%d blobs verified." % len(digests)))
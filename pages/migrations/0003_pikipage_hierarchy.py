@@ -0,0 +1,40 @@
+import os
+
+from django.db import migrations, models
+
+
+def update_hierarchy(apps, schema_editor):
+    PikiPage = apps.get_model('pages', 'PikiPage')
+    pages = []
+    for page in PikiPage.objects.only('rel_path').iterator():
+        page.parent_path = os.path.dirname(page.rel_path)
+        page.basename = os.path.basename(page.rel_path)
+        page.depth = page.rel_path.count('/')
+        pages.append(page)
+    PikiPage.objects.bulk_update(pages, ['parent_path', 'basename', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0002_historicalpikipage_group_perms_read_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pikipage',
+            name='basename',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='pikipage',
+            name='depth',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='pikipage',
+            name='parent_path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=1000),
+        ),
+        migrations.RunPython(update_hierarchy, migrations.RunPython.noop),
+    ]
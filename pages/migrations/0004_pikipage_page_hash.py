@@ -0,0 +1,37 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def update_page_hash(apps, schema_editor):
+    for model_name in ['PikiPage', 'HistoricalPikiPage']:
+        model = apps.get_model('pages', model_name)
+        pages = []
+        for page in model.objects.only('page_txt').iterator():
+            page.page_hash = hashlib.sha1(page.page_txt.replace('\r\n', '\n').strip('\n').encode('utf-8')).hexdigest()
+            pages.append(page)
+            if len(pages) >= 500:
+                model.objects.bulk_update(pages, ['page_hash'])
+                pages = []
+        model.objects.bulk_update(pages, ['page_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0003_pikipage_hierarchy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalpikipage',
+            name='page_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='pikipage',
+            name='page_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.RunPython(update_page_hash, migrations.RunPython.noop),
+    ]
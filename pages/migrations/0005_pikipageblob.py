@@ -0,0 +1,52 @@
+import hashlib
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def store_blobs(apps, schema_editor):
+    PikiPage = apps.get_model('pages', 'PikiPage')
+    HistoricalPikiPage = apps.get_model('pages', 'HistoricalPikiPage')
+    PikiPageBlob = apps.get_model('pages', 'PikiPageBlob')
+
+    def store_blob(txt):
+        digest = hashlib.sha256(txt.encode('utf-8')).hexdigest()
+        PikiPageBlob.objects.get_or_create(digest=digest, defaults={'data': zlib.compress(txt.encode('utf-8'))})
+        return digest
+
+    for page in PikiPage.objects.iterator():
+        page.page_blob_id = store_blob(page.page_txt)
+        page.save(update_fields=['page_blob'])
+        history = HistoricalPikiPage.objects.filter(id=page.id)
+        for history_id, page_txt in list(history.values_list('history_id', 'page_txt')):
+            history.filter(history_id=history_id).update(page_txt='', page_blob=store_blob(page_txt))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0004_pikipage_page_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PikiPageBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pages.pikipageblob')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='historicalpikipage',
+            name='page_blob',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='pages.pikipageblob'),
+        ),
+        migrations.AddField(
+            model_name='pikipage',
+            name='page_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pages.pikipageblob'),
+        ),
+        migrations.RunPython(store_blobs, migrations.RunPython.noop),
+    ]
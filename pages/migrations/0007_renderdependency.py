@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0006_searchindexqueue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderDependency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filter_str', models.CharField(db_index=True, max_length=1000)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pages.pikipage')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('page', 'filter_str'), name='unique_render_dependency')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0007_renderdependency'),
+    ]
+
+    # FTS5 table of the fts5 search backend (see pages.search_fts)
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE VIRTUAL TABLE pages_fts USING fts5("
+                "rel_path UNINDEXED, title, page_src, tag, modified_user, modified_time UNINDEXED, tokenize='unicode61')",
+            reverse_sql="DROP TABLE IF EXISTS pages_fts",
+        ),
+    ]
@@ -1,30 +1,105 @@
 from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import gettext as _
 from simple_history.models import HistoricalRecords
 
 from datetime import datetime
-import difflib
+import hashlib
 import logging
 import os
 from zoneinfo import ZoneInfo
 
 from users.models import get_userprofile
-from pages import url_page
+from pages import url_page, get_int_param
+from . import cache
+from . import diff
+import pages.parameter
+from . import storage
 
 import mycreole
 
 logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
 
+# Default number of versions in the history table of the meta page
+HISTORY_PAGE_SIZE = 50
+
+
+def page_txt_hash(txt):
+    # Line endings, leading and trailing newlines are not taken into account
+    return hashlib.sha1(txt.replace("\r\n", "\n").strip("\n").encode("utf-8")).hexdigest()
+
+
+def history_pagination(request, count=None):
+    page_size = max(get_int_param(request, "history_size", HISTORY_PAGE_SIZE), 1)
+    page_num = max(get_int_param(request, "history_page", 1), 1)
+    if count is None:
+        return page_size, page_num
+    page_count = max((count + page_size - 1) // page_size, 1)
+    return page_size, min(page_num, page_count), page_count
+
+
+class PikiPageBlob(models.Model):
+    # Content addressed page text, see pages.storage
+    digest = models.CharField(primary_key=True, max_length=64)
+    # zlib compressed text or (if base is set) reverse delta to the text of base
+    data = models.BinaryField()
+    base = models.ForeignKey("self", null=True, blank=True, on_delete=models.PROTECT, related_name="+")
+
+    def __str__(self):
+        return self.digest
+
+
+class PikiPageHistoryBase(models.Model):
+    def save(self, *args, **kwargs):
+        # The text is stored in page_blob
+        if self.page_blob_id is not None:
+            self.page_txt = ""
+        return super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+def with_page_txt(attribute):
+    # property returning the page of a historical record (attribute) with the text reconstructed from page_blob
+    def get(historical):
+        page = attribute.__get__(historical, type(historical))
+        page.page_txt = storage.history_page_txt(historical)
+        return page
+    return property(get)
+
+
+class PikiPageHistoricalRecords(HistoricalRecords):
+    # The pages created from historical records (e.g. to revert a version in the admin area) get their text
+    def get_extra_fields(self, model, fields):
+        extra_fields = super().get_extra_fields(model, fields)
+        for name in ["instance", "history_object"]:
+            extra_fields[name] = with_page_txt(extra_fields[name])
+        return extra_fields
+
 
 class PikiPage(models.Model):
-    SAVE_ON_CHANGE_FIELDS = ["rel_path", "page_txt", "tags", "deleted", "owner", "group"]
+    SAVE_ON_CHANGE_FIELDS = [
+        "rel_path", "page_txt", "tags", "deleted", "owner", "group",
+        "owner_perms_read", "owner_perms_write", "group_perms_read", "group_perms_write", "other_perms_read", "other_perms_write"
+    ]
+    # fields which add or remove the page from the listings of a user
+    LISTING_FIELDS = ["rel_path", "deleted", "owner", "group", "owner_perms_read", "group_perms_read", "other_perms_read"]
     #
     rel_path = models.CharField(unique=True, max_length=1000)
     page_txt = models.TextField(max_length=50000)
     tags = models.CharField(max_length=1000, null=True, blank=True)
     deleted = models.BooleanField(default=False)
+    # hash of the normalised page_txt (see page_txt_hash)
+    page_hash = models.CharField(max_length=40, default="", blank=True)
+    # page_txt in the blob storage (referenced by the history)
+    page_blob = models.ForeignKey(PikiPageBlob, null=True, blank=True, on_delete=models.PROTECT, related_name="+")
+    # hierarchy (derived from rel_path)
+    parent_path = models.CharField(max_length=1000, db_index=True, default="", blank=True)
+    basename = models.CharField(max_length=1000, db_index=True, default="", blank=True)
+    depth = models.IntegerField(db_index=True, default=0)
     #
     creation_time = models.DateTimeField(null=True, blank=True)
     creation_user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name="creation_user")
@@ -43,10 +118,13 @@ class PikiPage(models.Model):
     other_perms_read = models.BooleanField(default=True)
     other_perms_write = models.BooleanField(default=False)
     #
-    history = HistoricalRecords()
+    history = PikiPageHistoricalRecords(excluded_fields=["parent_path", "basename", "depth"], bases=[PikiPageHistoryBase])
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._render_dependencies = set()
+        self._render_dirs = set()
+        self._render_request = None
 
     def prepare_save(self, request):
         # Set date
@@ -58,17 +136,87 @@ class PikiPage(models.Model):
         self.owner = self.owner or request.user
         self.modified_user = request.user
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.take_snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self.take_snapshot(fields)
+
+    def take_snapshot(self, fields=None):
+        # remember the loaded values (of all or the given fields) to detect changes without reading the database again
+        deferred = self.get_deferred_fields()
+        if fields is None or not hasattr(self, "_snapshot"):
+            self._snapshot = {}
+        for field in self._meta.concrete_fields:
+            if field.attname not in deferred and (fields is None or field.name in fields or field.attname in fields):
+                self._snapshot[field.name] = getattr(self, field.attname)
+
+    def dirty_fields(self):
+        # fields which differ from the snapshot (or are not in the snapshot)
+        snapshot = getattr(self, "_snapshot", {})
+        deferred = self.get_deferred_fields()
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.attname not in deferred
+            and (field.name not in snapshot or getattr(self, field.attname) != snapshot[field.name])
+        ]
+
+    def changed_fields(self):
+        # list of changed SAVE_ON_CHANGE_FIELDS and the original values
+        snapshot = getattr(self, "_snapshot", {})
+        deferred = self.get_deferred_fields()
+        attnames = {key: self._meta.get_field(key).attname for key in self.SAVE_ON_CHANGE_FIELDS}
+        missing = [key for key in self.SAVE_ON_CHANGE_FIELDS if key not in snapshot and attnames[key] not in deferred]
+        if len(missing) > 0:
+            values = PikiPage.objects.filter(id=self.id).values(*[attnames[key] for key in missing]).get()
+            snapshot = dict(snapshot, **{key: values[attnames[key]] for key in missing})
+        changed = [key for key in self.SAVE_ON_CHANGE_FIELDS if key in snapshot and getattr(self, attnames[key]) != snapshot[key]]
+        return changed, snapshot
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        # paths which are added or removed from the set of available pages
+        changed_paths = [self.rel_path]
+        txt_changed = True
         if self.id and not force_update:
-            orig = PikiPage.objects.get(id=self.id)
-            for key in self.SAVE_ON_CHANGE_FIELDS:
-                if getattr(self, key) != getattr(orig, key):
-                    break
-            else:
+            changed, orig = self.changed_fields()
+            if len(changed) == 0:
                 self.save_needed = False
                 return False
+            if not any(key in changed for key in self.LISTING_FIELDS):
+                changed_paths = []
+            else:
+                changed_paths = [orig.get("rel_path", self.rel_path), self.rel_path]
+            txt_changed = "page_txt" in changed
+            if update_fields is None:
+                # only the changed columns are written
+                update_fields = set(self.dirty_fields())
+                if "rel_path" in changed:
+                    update_fields.update(["parent_path", "basename", "depth"])
+                if txt_changed:
+                    update_fields.update(["page_hash", "page_blob"])
+                else:
+                    update_fields.difference_update(["page_txt", "page_hash", "page_blob"])
         self.save_needed = True
-        return models.Model.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        self.update_hierarchy()
+        if txt_changed:
+            self.page_hash = page_txt_hash(self.page_txt)
+            self.page_blob_id = storage.store_blob(self.page_txt)
+        rv = models.Model.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        self.take_snapshot()
+        if txt_changed and pages.parameter.get(pages.parameter.HISTORY_DELTA):
+            storage.compress_history(self)
+        cache.invalidate(self)
+        cache.invalidate_dependents(changed_paths)
+        return rv
+
+    def update_hierarchy(self):
+        self.parent_path = os.path.dirname(self.rel_path)
+        self.basename = os.path.basename(self.rel_path)
+        self.depth = self.rel_path.count("/")
 
     #
     # Set history datetime to modified datetime
@@ -81,6 +229,12 @@ class PikiPage(models.Model):
     def _history_date(self, value):
         self.modified_time = value
 
+    def get_history(self, history_id):
+        # historical version with reconstructed page_txt
+        h_page = self.history.get(history_id=history_id)
+        h_page.page_txt = storage.history_page_txt(h_page)
+        return h_page
+
     #
     # My information
     #
@@ -93,22 +247,45 @@ class PikiPage(models.Model):
     #
     def render_to_html(self, request, history=None):
         if history:
-            h = self.history.get(history_id=history)
-            return self.render_text(request, h.page_txt)
+            # raises DoesNotExist for versions of other pages, before anything is taken from the cache
+            self.history.values_list("history_id", flat=True).get(history_id=history)
+            html = cache.get_history(self, request, history)
+            if html is None:
+                html = self.render_text(request, self.get_history(history).page_txt)
+                if len(self._render_dependencies) == 0:
+                    # without page listings, the version will never change
+                    cache.set_history(self, request, history, html, self._render_dirs)
+            return html
         else:
-            return self.render_text(request, self.page_txt)
-
-    def user_datetime(self, request, dtm):
+            html = cache.get_rendered(self, request)
+            if html is None:
+                token = cache.listing_token()
+                html = self.render_text(request, self.page_txt)
+                cache.set_rendered(self, request, html, self._render_dependencies, self._render_dirs, token)
+            return html
+
+    def user_timezone(self, request):
         try:
             up = get_userprofile(request.user)
         except AttributeError:
-            tz = ZoneInfo("UTC")
+            return ZoneInfo("UTC")
         else:
-            tz = ZoneInfo(up.timezone)
-        #
-        return datetime.astimezone(dtm, tz)
+            return ZoneInfo(up.timezone)
+
+    def user_datetime(self, request, dtm):
+        return datetime.astimezone(dtm, self.user_timezone(request))
 
     def render_meta(self, request, history):
+        if history:
+            self.history.values_list("history_id", flat=True).get(history_id=history)
+        variant = (history, diff.get_diff_mode(request)) + history_pagination(request) + (str(self.user_timezone(request)), )
+        html = cache.get_meta(self, variant)
+        if html is None:
+            html = self.render_meta_content(request, history)
+            cache.set_meta(self, variant, html)
+        return html
+
+    def render_meta_content(self, request, history):
         # Page information
         meta = f'= {_("Meta data")}\n'
         meta += f'|{_("Created by")}:|{self.creation_user}|\n'
@@ -121,42 +298,72 @@ class PikiPage(models.Model):
         #
         # List of history page versions
         #
-        hl = self.history.all()[1:]
-        if len(hl) > 0:
-            meta += f'= {_("History")}\n'
-            meta += f'| ={_("Version")} | ={_("Date")} | ={_("Page")} | ={_("Meta data")} | ={_("Page changed")} | ={_("Tags changed")} | \n'
-            # Current
-            name = _("Current")
-            meta += f"| {name} \
-                      | {self.user_datetime(request, self.modified_time)} \
-                      | [[{url_page(self.rel_path)} | Page]] \
-                      | [[{url_page(self.rel_path, meta=None)} | Meta]] |"
-            page_content = self.page_txt.replace("\r\n", "\n").strip("\n")
+        versions = self.history.values_list("history_id", "modified_time", "page_hash", "tags")[1:]
+        if len(versions) > 0:
+            # Current page and all versions with page or tags changes [history_id, modified_time, page_changed, tags_changed]
+            entries = [[None, self.modified_time, None, None]]
+            page_hash = self.page_hash
             tags = self.tags
-            for h_page in hl:
-                page_changed = page_content != h_page.page_txt.replace("\r\n", "\n").strip("\n")
-                tags_changed = tags != h_page.tags
+            for history_id, modified_time, h_page_hash, h_tags in versions:
+                page_changed = page_hash != h_page_hash
+                tags_changed = tags != h_tags
                 if page_changed or tags_changed:
+                    entries[-1][2:] = [page_changed, tags_changed]
+                    entries.append([history_id, modified_time, None, None])
+                    page_hash = h_page_hash
+                    tags = h_tags
+            page_size, page_num, page_count = history_pagination(request, len(entries))
+            #
+            meta += f'= {_("History")}\n'
+            meta += f'| ={_("Version")} | ={_("Date")} | ={_("Page")} | ={_("Meta data")} | ={_("Page changed")} | ={_("Tags changed")} | \n'
+            for history_id, modified_time, page_changed, tags_changed in entries[(page_num - 1) * page_size:page_num * page_size]:
+                if history_id is None:
+                    name = _("Current")
+                    meta += f"| {name} \
+                              | {self.user_datetime(request, modified_time)} \
+                              | [[{url_page(self.rel_path)} | Page]] \
+                              | [[{url_page(self.rel_path, meta=None)} | Meta]] |"
+                else:
+                    meta += f"| {history_id} \
+                                | {self.user_datetime(request, modified_time)} \
+                                | [[{url_page(self.rel_path, history=history_id)} | Page]] \
+                                | [[{url_page(self.rel_path, meta=None, history=history_id)} | Meta]] (with diff to current) |"
+                if page_changed is None:
+                    meta += " --- | --- |\n"
+                else:
                     meta += " %s |" % ("Yes" if page_changed else "No")
                     meta += " %s |" % ("Yes" if tags_changed else "No")
                     meta += "\n"
-                    meta += f"| {h_page.history_id} \
-                                | {self.user_datetime(request, h_page.modified_time)} \
-                                | [[{url_page(self.rel_path, history=h_page.history_id)} | Page]] \
-                                | [[{url_page(self.rel_path, meta=None, history=h_page.history_id)} | Meta]] (with diff to current) |"
-                    page_content = h_page.page_txt[:].replace("\r\n", "\n").strip("\n")
-                    tags = h_page.tags
-            meta += " --- | --- |\n"
+            if page_count > 1:
+                params = dict(meta=None, history_size=page_size)
+                if history:
+                    params["history"] = history
+                meta += f'\n{_("Page")} {page_num} / {page_count}:'
+                if page_num > 1:
+                    meta += f' [[{url_page(self.rel_path, history_page=page_num - 1, **params)} | {_("Previous")}]]'
+                if page_num < page_count:
+                    meta += f' [[{url_page(self.rel_path, history_page=page_num + 1, **params)} | {_("Next")}]]'
+                meta += "\n"
         # Diff
         html_diff = ""
         if history:
-            h_page = self.history.get(history_id=history)
+            diff_mode = diff.get_diff_mode(request)
             #
             meta += f'= {_("Page differences")}\n'
+            other_mode = diff.DIFF_UNIFIED if diff_mode == diff.DIFF_TABLE else diff.DIFF_TABLE
+            meta += f'[[{url_page(self.rel_path, meta=None, history=history, diff=other_mode)} | {_("Show as %s diff") % other_mode}]]\n'
             #
-            left_lines = self.page_txt.splitlines()
-            right_lines = h_page.page_txt.splitlines()
-            html_diff = difflib.HtmlDiff(wrapcolumn=80).make_table(left_lines, right_lines, "Current page", "Page Version %d" % history)
+            current = self.history.values_list("history_id", flat=True).first()
+            html_diff = cache.get_diff(current, history, diff_mode)
+            if html_diff is None:
+                h_page = self.get_history(history)
+                left_lines = self.page_txt.splitlines()
+                right_lines = h_page.page_txt.splitlines()
+                if diff_mode == diff.DIFF_UNIFIED:
+                    html_diff = diff.unified(left_lines, right_lines, "Current page", "Page Version %d" % history)
+                else:
+                    html_diff = diff.html_table(left_lines, right_lines, "Current page", "Page Version %d" % history)
+                cache.set_diff(current, history, diff_mode, html_diff)
         #
         return mycreole.render_simple(meta) + html_diff
 
@@ -164,13 +371,40 @@ class PikiPage(models.Model):
     # Creole stuff
     #
     def render_text(self, request, txt):
+        # filter strings of the page listing macros used in txt
+        self._render_dependencies = set()
+        # the page listing macros show only the pages readable by the user of request
+        self._render_request = request
         macros = {
             "subpages": self.macro_subpages,
             "allpages": self.macro_allpages,
             "subpagetree": self.macro_subpagetree,
             "allpagestree": self.macro_allpagestree,
         }
-        return mycreole.render(request, txt, self.rel_path, macros=macros)
+        # page directories of the attachments used by txt (see cache.render_class)
+        self._render_dirs = set([self.rel_path])
+        # Render block by block, unchanged blocks without macros are taken from the cache
+        blocks = creole_blocks(txt)
+        keys = [None if "<<" in block else cache.block_key(request, self.rel_path, block) for block in blocks]
+        cached = cache.get_blocks([key for key in keys if key is not None])
+        rendered = {}
+        html = []
+        for block, key in zip(blocks, keys):
+            try:
+                html.append(cached[key])
+            except KeyError:
+                request.piki_attachment_log = set()
+                try:
+                    html.append(mycreole.render(request, block, self.rel_path, macros=macros))
+                finally:
+                    dirs = request.piki_attachment_log
+                    del request.piki_attachment_log
+                self._render_dirs |= dirs
+                # blocks using attachments of other pages depend on more than the block key
+                if key is not None and dirs <= set([self.rel_path]):
+                    rendered[key] = html[-1]
+        cache.set_blocks(rendered)
+        return "\n".join(html)
 
     def macro_subpages(self, *args, **kwargs):
         return self.macro_pages(*args, **kwargs)
@@ -213,8 +447,29 @@ class PikiPage(models.Model):
         if not allpages:
             filter_str = os.path.join(self.rel_path, filter_str)
         #
-        pages = PikiPage.objects.filter(rel_path__contains=filter_str)
-        pl = page_list([p for p in pages if not p.deleted])
+        self._render_dependencies.add(filter_str)
+        if depth == 1 and not tree and (filter_str == "" or filter_str.endswith("/")):
+            # the children of a page (or the top level pages)
+            pages = PikiPage.objects.filter(deleted=False, parent_path=os.path.dirname(filter_str))
+        else:
+            condition = Q(**prefix_range(filter_str))
+            ancestors = []
+            parent = os.path.dirname(filter_str)
+            while tree and parent != "":
+                ancestors.append(parent)
+                parent = os.path.dirname(parent)
+            if len(ancestors) > 0:
+                # the ancestors (e.g. the page of subpagetree) are nodes of the tree and need their links as well
+                condition |= Q(rel_path__in=ancestors)
+                self._render_dependencies.update(ancestors)
+            pages = PikiPage.objects.filter(condition, deleted=False)
+            if depth and not tree:
+                parent_depth = -1 if allpages else self.rel_path.count("/")
+                pages = pages.filter(depth__lte=parent_depth + depth)
+        if self._render_request is not None:
+            from .access import readable_pages
+            pages = readable_pages(self._render_request, pages)
+        pl = page_list(pages.order_by("basename", "rel_path").only("rel_path", "basename"))
         #
         if tree:
             return "<pre>\n" + page_tree(pl).html() + "</pre>\n"
@@ -222,15 +477,102 @@ class PikiPage(models.Model):
             return pl.html_list(depth=depth, filter_str=filter_str, parent_rel_path='' if allpages else self.rel_path)
 
 
+class RenderDependency(models.Model):
+    # Filter string of a page listing macro used by a page, see cache.invalidate_dependents
+    page = models.ForeignKey(PikiPage, on_delete=models.CASCADE, related_name="+")
+    filter_str = models.CharField(max_length=1000, db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["page", "filter_str"], name="unique_render_dependency")]
+
+    def __str__(self):
+        return "%s: %s" % (self.page_id, self.filter_str)
+
+
+class SearchIndexQueue(models.Model):
+    # Pages waiting for the background update of the search index (see pages.search.queue_update)
+    rel_path = models.CharField(unique=True, max_length=1000)
+    queued_time = models.DateTimeField()
+
+    def __str__(self):
+        return self.rel_path
+
+
+class ListingChange(models.Model):
+    # Log of the pages added to or removed from the listings (see cache.invalidate_dependents), which allows process
+    # local indexes (e.g. pages.autocomplete) to apply the changes instead of loading all pages again
+    rel_path = models.CharField(max_length=1000)
+
+    def __str__(self):
+        return self.rel_path
+
+
+def get_page(request, rel_path):
+    # Request scoped identity map, every page is loaded once per request (including the referenced users and group)
+    try:
+        request_pages = request.piki_pages
+    except AttributeError:
+        request_pages = request.piki_pages = {}
+    if rel_path not in request_pages:
+        try:
+            request_pages[rel_path] = PikiPage.objects.select_related(
+                "creation_user", "modified_user", "owner", "group"
+            ).get(rel_path=rel_path)
+        except PikiPage.DoesNotExist:
+            request_pages[rel_path] = None
+    return request_pages[rel_path]
+
+
+def prefix_range(prefix):
+    # Filter for the rel_paths starting with prefix as range on the rel_path index (a LIKE query is neither indexed nor
+    # case sensitive in SQLite)
+    if prefix == "":
+        return {}
+    return {"rel_path__gte": prefix, "rel_path__lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+
+# Minimum size of a separately rendered block
+BLOCK_MIN_SIZE = 2000
+
+
+def creole_blocks(txt):
+    # Split creole text in blocks, which render to the same html separately as the whole text (joined by newlines).
+    # The text is only split in front of a heading after an empty line outside of preformatted text, where no creole
+    # construct continues. Texts with macros (which might span empty lines or refer to the whole text) stay in one
+    # block, small sections are joined to blocks of at least BLOCK_MIN_SIZE characters.
+    txt = (txt or "").replace("\r\n", "\n")
+    if "<<" in txt or len(txt) < 2 * BLOCK_MIN_SIZE:
+        return [txt]
+    sections = []
+    section = []
+    nowiki = False
+    empty_line = True
+    for line in txt.split("\n"):
+        if not nowiki and empty_line and line.startswith("=") and len(section) > 0:
+            sections.append("\n".join(section))
+            section = []
+        section.append(line)
+        if line.strip() == "{{{":
+            nowiki = True
+        elif line.strip() == "}}}":
+            nowiki = False
+        empty_line = line.strip() == ""
+    sections.append("\n".join(section))
+    blocks = []
+    for section in sections:
+        if len(blocks) > 0 and len(blocks[-1]) < BLOCK_MIN_SIZE:
+            blocks[-1] += "\n" + section
+        else:
+            blocks.append(section)
+    return blocks
+
+
 class page_list(list):
+    # pages ordered by basename
     def __init__(self, *args, **kwargs):
         return super().__init__(*args, **kwargs)
 
-    def sort_basename(self):
-        return list.sort(self, key=lambda x: os.path.basename(x.rel_path))
-
     def creole_list(self, depth=None, filter_str='', parent_rel_path=''):
-        self.sort_basename()
         depth = depth or 9999   # set a random high value if None
         #
         rv = ""
@@ -239,7 +581,7 @@ class page_list(list):
             if page.rel_path.startswith(filter_str) and page.rel_path != filter_str:
                 name = page.rel_path[len(parent_rel_path):].lstrip("/")
                 if name.count('/') < depth:
-                    first_char = os.path.basename(name)[0].upper()
+                    first_char = page.basename[0].upper()
                     if last_char != first_char:
                         last_char = first_char
                         rv += f"=== {first_char}\n"
@@ -258,6 +600,7 @@ class page_tree(dict):
 
     def __init__(self, pl: page_list):
         super().__init__()
+        self._rel_paths = set(page.rel_path for page in pl)
         for page in pl:
             store_item = self
             for entry in page.rel_path.split("/"):
@@ -279,11 +622,7 @@ class page_tree(dict):
         for entry in sorted(list(base.keys())):
             l -= 1
             page_path = os.path.join(rel_path, entry)
-            try:
-                PikiPage.objects.get(rel_path=page_path)
-            except PikiPage.DoesNotExist:
-                pass
-            else:
+            if page_path in self._rel_paths:
                 entry = f'<a href="{url_page(page_path)}">{entry}</a>'
             rv += fill + (self.L_PATTERN if l == 0 else self.T_PATTERN) + entry + "\n"
             rv += self.html(page_path, fill=fill+(self.D_PATTERN if l == 0 else self.I_PATTERN))
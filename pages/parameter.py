@@ -4,6 +4,11 @@ import importlib
 import os
 
 CMS_MODE = "CMS_MODE"
+HISTORY_DELTA = "HISTORY_DELTA"
+HISTORY_KEYFRAME_INTERVAL = "HISTORY_KEYFRAME_INTERVAL"
+SEARCH_BACKEND = "SEARCH_BACKEND"
+SEARCH_INDEX_ASYNC = "SEARCH_INDEX_ASYNC"
+SEARCH_INDEX_DELAY = "SEARCH_INDEX_DELAY"
 
 
 def no_access(*args, **kwargs):
@@ -12,6 +17,11 @@ def no_access(*args, **kwargs):
 
 DEFAULTS = {
     CMS_MODE: False,
+    HISTORY_DELTA: False,
+    HISTORY_KEYFRAME_INTERVAL: 20,
+    SEARCH_BACKEND: "whoosh",
+    SEARCH_INDEX_ASYNC: True,
+    SEARCH_INDEX_DELAY: 2,
 }
 
 
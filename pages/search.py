@@ -1,65 +1,318 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext as _
 
 import fstools
+from functools import reduce
+from html import escape
 import logging
+import operator
 import os
-from whoosh.fields import Schema, ID, TEXT, DATETIME
+import threading
+import time
+from urllib.parse import urlencode
+from whoosh.fields import Schema, ID, KEYWORD, TEXT, DATETIME
 from whoosh.qparser.dateparse import DateParserPlugin
-from whoosh import index, qparser
+from whoosh import index, qparser, query
+from zoneinfo import ZoneInfo
 
-from .models import PikiPage
+from .access import readable_pages
+from . import cache
+from .models import PikiPage, SearchIndexQueue
+from pages import url_page
+import pages.parameter
 
 logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
 
+# Default and maximum number of search results per page
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_PAGE_SIZE = 100
+# Seconds between two looks at the index directory for changes by other processes
+INDEX_VERSION_INTERVAL = 1
+
 
 SCHEMA = Schema(
     id=ID(unique=True, stored=True),
+    # the page path and all its ancestors (subtree filter)
+    path=KEYWORD(commas=True),
     # Page
     title=TEXT,
-    page_src=TEXT,
+    page_src=TEXT(stored=True),
     tag=TEXT,
     # metadata
     creation_time=DATETIME,
-    modified_time=DATETIME,
+    modified_time=DATETIME(stored=True),
     modified_user=TEXT
 )
 
 
-def mk_whooshpath_if_needed():
-    if not os.path.exists(settings.WHOOSH_PATH):
-        fstools.mkdir(settings.WHOOSH_PATH)
+# Parsed queries (process wide), normalized query text -> [query, expiry time or None]
+QUERY_CACHE_SIZE = 256
+_queries_lock = threading.Lock()
+_queries = OrderedDict()
+
+#
+# Search backends
+#
+# "whoosh" keeps the index in WHOOSH_PATH, "fts5" (see pages.search_fts) in an SQLite FTS5 table of the page database.
+# SEARCH_BACKEND also takes the dotted path of a search_backend class.
+#
+SEARCH_BACKENDS = {
+    "whoosh": "pages.search.whoosh_backend",
+    "fts5": "pages.search_fts.fts5_backend",
+}
+
+_backends_lock = threading.Lock()
+_backends = {}
+
+
+def get_backend(name=None):
+    name = name or pages.parameter.get(pages.parameter.SEARCH_BACKEND)
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = pages.parameter.__get_object_by_name__(SEARCH_BACKENDS.get(name, name))()
+        return _backends[name]
+
+
+class search_backend(ABC):
+    name = None
+    # The index is updated by page_saved together with the page (no queue needed)
+    transactional = False
+
+    @abstractmethod
+    def create_index(self):
+        pass
+
+    @abstractmethod
+    def load_index(self, upgrade=True):
+        # With upgrade an index with an outdated schema is created again
+        pass
+
+    @abstractmethod
+    def index_version(self, ix):
+        # changes with every change of the index
+        pass
+
+    def schema_outdated(self, ix):
+        return False
+
+    @abstractmethod
+    def rebuild_index(self, ix, procs=1, limitmb=128):
+        pass
+
+    @abstractmethod
+    def indexed_times(self, ix):
+        # rel_path -> modified_time of all documents
+        pass
+
+    @abstractmethod
+    def index_pages(self, ix, rel_paths):
+        # Update the documents of existing pages, remove the documents of deleted or renamed pages
+        pass
+
+    @abstractmethod
+    def add_item(self, ix, pp: PikiPage):
+        pass
+
+    @abstractmethod
+    def delete_item(self, ix, pp: PikiPage):
+        pass
+
+    @abstractmethod
+    def search(self, ix, q, limit, path=None):
+        # [rel_path, hit] of the best limit (None for all) hits for the parsed query q, None if q is not supported. With
+        # path only the page path and its subpages are searched.
+        pass
+
+    @abstractmethod
+    def highlights(self, ix, hit):
+        pass
+
+
+class whoosh_backend(search_backend):
+    name = "whoosh"
+
+    def __init__(self, path=None):
+        self._path = path
+        # Process wide index handle and one searcher per thread (a searcher must not be shared between threads)
+        self._index_lock = threading.RLock()
+        self._index = None
+        self._searchers_lock = threading.Lock()
+        self._searchers = {}
+        # [index, version, time of the next look at the index directory]
+        self._version = None
+
+    @property
+    def path(self):
+        return self._path or settings.WHOOSH_PATH
+
+    def mk_whooshpath_if_needed(self):
+        if not os.path.exists(self.path):
+            fstools.mkdir(self.path)
+
+    def create_index(self):
+        with self._index_lock:
+            self.mk_whooshpath_if_needed()
+            self._index = index.create_in(self.path, schema=SCHEMA)
+            self._version = None
+            logger.debug('Search Index created.')
+            return self._index
+
+    def load_index(self, upgrade=True):
+        with self._index_lock:
+            if self._index is None:
+                self.mk_whooshpath_if_needed()
+                try:
+                    self._index = index.open_dir(self.path)
+                except index.EmptyIndexError:
+                    self.create_index()
+                else:
+                    logger.debug('Search Index opened.')
+                    if upgrade and self.schema_outdated(self._index):
+                        # the documents of an older version can not be updated (e.g. missing fields)
+                        logger.warning('Search Index has an outdated schema, creating it again.')
+                        self.rebuild_index(self.create_index())
+            return self._index
+
+    def index_version(self, ix):
+        # The index directory is read at most every INDEX_VERSION_INTERVAL seconds, own writes are seen immediately
+        version = self._version
+        if version is None or version[0] is not ix or time.monotonic() >= version[2]:
+            version = [ix, self.read_index_version(ix), time.monotonic() + INDEX_VERSION_INTERVAL]
+            self._version = version
+        return version[1]
+
+    def read_index_version(self, ix):
+        # also changes, if the index was created again (e.g. by another process)
+        try:
+            return ix.latest_generation(), ix.last_modified()
+        except OSError:
+            return ix.latest_generation(), None
+
+    def index_changed(self):
+        self._version = None
+
+    def schema_outdated(self, ix):
+        return ix.schema != SCHEMA
+
+    def get_searcher(self, ix):
+        version = self.index_version(ix)
+        thread = threading.current_thread()
+        outdated = []
+        with self._searchers_lock:
+            entry = self._searchers.get(thread.ident)
+            if entry is None or entry[0] is not thread or entry[1] is not ix or entry[2] != version:
+                if entry is not None:
+                    outdated.append(entry[3])
+                # the searchers of finished threads
+                for ident, (other, other_ix, other_version, searcher) in list(self._searchers.items()):
+                    if not other.is_alive():
+                        outdated.append(searcher)
+                        del self._searchers[ident]
+                logger.debug('Opening a new searcher for index version %s.', repr(version))
+                entry = [thread, ix, version, ix.searcher()]
+                self._searchers[thread.ident] = entry
+        for searcher in outdated:
+            searcher.close()
+        return entry[3]
+
+    def rebuild_index(self, ix, procs=1, limitmb=128):
+        # Stream all pages through one writer with a single commit (procs > 1 writes multiple segments in parallel)
+        n = 0
+        with ix.writer(procs=procs, limitmb=limitmb, multisegment=procs > 1) as w:
+            for pp in PikiPage.objects.filter(deleted=False).select_related("modified_user").iterator(chunk_size=500):
+                w.add_document(**document_data(pp))
+                n += 1
+            logger.info('Committing %d documents to the search index.', n)
+        self.index_changed()
+        return n
+
+    def indexed_times(self, ix):
+        with ix.searcher() as s:
+            return {fields["id"]: fields.get("modified_time") for fields in s.all_stored_fields()}
+
+    def index_pages(self, ix, rel_paths):
+        existing = {
+            pp.rel_path: pp for pp in PikiPage.objects.filter(rel_path__in=rel_paths, deleted=False).select_related("modified_user")
+        }
+        with ix.writer(timeout=5) as w:
+            for rel_path in rel_paths:
+                if rel_path in existing:
+                    logger.info('Updating document with id=%s in the search index.', rel_path)
+                    w.update_document(**document_data(existing[rel_path]))
+                else:
+                    logger.info('Removing document with id=%s from the search index.', rel_path)
+                    w.delete_by_term("id", rel_path)
+        self.index_changed()
+
+    def add_item(self, ix, pp: PikiPage):
+        data = document_data(pp)
+        with ix.writer() as w:
+            logger.info('Adding document with id=%s to the search index.', data.get('id'))
+            w.update_document(**data)
+            for key in data:
+                logger.debug('  - Adding %s=%s', key, repr(data[key]))
+        self.index_changed()
+
+    def delete_item(self, ix, pp: PikiPage):
+        with ix.writer() as w:
+            logger.info('Removing document with id=%s from the search index.', pp.rel_path)
+            w.delete_by_term("id", pp.rel_path)
+        self.index_changed()
+
+    def search(self, ix, q, limit, path=None):
+        subtree = None if path is None else query.Term("path", path)
+        return [[hit["id"], hit] for hit in self.get_searcher(ix).search(q, filter=subtree, limit=limit)]
+
+    def highlights(self, ix, hit):
+        # the text is only available in indexes created with a stored page_src
+        return hit.highlights("page_src") if "page_src" in hit else ""
 
 
 def create_index():
-    mk_whooshpath_if_needed()
-    logger.debug('Search Index created.')
-    return index.create_in(settings.WHOOSH_PATH, schema=SCHEMA)
+    return get_backend().create_index()
 
 
-def rebuild_index(ix):
-    pages = PikiPage.objects.all()
-    for pp in pages:
-        if not pp.deleted:
-            add_item(ix, pp)
-    return len(pages)
+def load_index(upgrade=True):
+    return get_backend().load_index(upgrade)
 
 
-def load_index():
-    mk_whooshpath_if_needed()
-    try:
-        ix = index.open_dir(settings.WHOOSH_PATH)
-    except index.EmptyIndexError:
-        ix = create_index()
-    else:
-        logger.debug('Search Index opened.')
-    return ix
+def schema_outdated(ix):
+    return get_backend().schema_outdated(ix)
 
 
-def add_item(ix, pp: PikiPage):
-    # Define Standard data
-    #
-    data = dict(
+def rebuild_index(ix, procs=1, limitmb=128):
+    return get_backend().rebuild_index(ix, procs=procs, limitmb=limitmb)
+
+
+def index_drift(ix):
+    # rel_paths of the pages to be added, updated and removed to bring the index in line with the database
+    indexed = get_backend().indexed_times(ix)
+    added = []
+    updated = []
+    for rel_path, modified_time in PikiPage.objects.filter(deleted=False).values_list("rel_path", "modified_time").iterator():
+        if rel_path not in indexed:
+            added.append(rel_path)
+        elif indexed.pop(rel_path) != modified_time:
+            updated.append(rel_path)
+    return added, updated, list(indexed)
+
+
+def sync_index(ix, added, updated, removed, chunk_size=500):
+    # Apply the result of index_drift
+    rel_paths = added + updated + removed
+    for i in range(0, len(rel_paths), chunk_size):
+        get_backend().index_pages(ix, rel_paths[i:i + chunk_size])
+
+
+def document_data(pp: PikiPage):
+    return dict(
         id=pp.rel_path,
         #
         title=pp.title,
@@ -68,18 +321,54 @@ def add_item(ix, pp: PikiPage):
         #
         creation_time=pp.creation_time,
         modified_time=pp.modified_time,
-        modified_user=None if pp.modified_user is None else pp.modified_user.username
+        modified_user=None if pp.modified_user is None else pp.modified_user.username,
+        path=",".join(ancestor_paths(pp.rel_path)),
     )
-    with ix.writer() as w:
-        logger.info('Adding document with id=%s to the search index.', data.get('id'))
-        w.update_document(**data)
-        for key in data:
-            logger.debug('  - Adding %s=%s', key, repr(data[key]))
 
 
-def whoosh_search(search_txt):
-    ix = load_index()
-    qp = qparser.MultifieldParser(['title', 'page_src', 'tag'], ix.schema)
+def ancestor_paths(rel_path):
+    # "a/b/c" -> ["a", "a/b", "a/b/c"]
+    parts = rel_path.split("/")
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def add_item(ix, pp: PikiPage):
+    get_backend().add_item(ix, pp)
+
+
+def delete_item(ix, pp: PikiPage):
+    get_backend().delete_item(ix, pp)
+
+
+@receiver(post_save, sender=PikiPage)
+def page_saved(sender, instance, **kwargs):
+    backend = get_backend()
+    if backend.transactional:
+        if instance.deleted:
+            backend.delete_item(backend.load_index(), instance)
+        else:
+            backend.add_item(backend.load_index(), instance)
+
+
+def normalize_query(search_txt):
+    return " ".join((search_txt or "").split())
+
+
+def is_relative(q):
+    # Queries on date fields might contain relative dates (e.g. "-5d to now"), which are resolved while parsing
+    return any(isinstance(SCHEMA[leaf.field()], DATETIME) for leaf in q.leaves() if leaf.field() in SCHEMA)
+
+
+def parse_query(search_txt):
+    if search_txt is None:
+        return None
+    key = normalize_query(search_txt)
+    with _queries_lock:
+        entry = _queries.get(key)
+        if entry is not None and (entry[1] is None or entry[1] > time.time()):
+            _queries.move_to_end(key)
+            return entry[0]
+    qp = qparser.MultifieldParser(['title', 'page_src', 'tag'], SCHEMA)
     qp.add_plugin(DateParserPlugin(free=True))
     try:
         q = qp.parse(search_txt)
@@ -87,21 +376,190 @@ def whoosh_search(search_txt):
         return None
     except Exception:
         return None
-    with ix.searcher() as s:
-        results = s.search(q, limit=None)
-        rpl = []
-        for hit in results:
-            rpl.append(hit['id'])
-        return rpl
+    with _queries_lock:
+        _queries[key] = [q, time.time() + cache.SEARCH_RELATIVE_TIMEOUT if is_relative(q) else None]
+        while len(_queries) > QUERY_CACHE_SIZE:
+            _queries.popitem(last=False)
+    return q
 
 
-def delete_item(ix, pp: PikiPage):
-    with ix.writer() as w:
-        logger.info('Removing document with id=%s from the search index.', pp.rel_path)
-        w.delete_by_term("id", pp.rel_path)
+class search_result(list):
+    # One page of readable search hits as [rel_path, highlighted text]
+    def __init__(self, search_txt, page_num, page_size, more, path=None):
+        super().__init__()
+        self.search_txt = search_txt
+        self.page_num = page_num
+        self.page_size = page_size
+        self.more = more
+        self.path = path
+
+    def url(self, page_num):
+        params = {"q": self.search_txt, "page": page_num, "size": self.page_size}
+        if self.path is not None:
+            params["path"] = self.path
+        return "?" + urlencode(params)
+
+    def html(self):
+        if len(self) == 0:
+            return f'<p>{_("No results found.")}</p>\n'
+        rv = '<dl class="search-results">\n'
+        for rel_path, highlights in self:
+            rv += f'<dt><a href="{url_page(rel_path)}">{escape(rel_path)}</a></dt>\n'
+            rv += f'<dd>{highlights}</dd>\n'
+        rv += '</dl>\n'
+        if self.page_num > 1 or self.more:
+            rv += f'<p>{_("Page")} {self.page_num}:'
+            if self.page_num > 1:
+                rv += f' <a href="{escape(self.url(self.page_num - 1))}">{_("Previous")}</a>'
+            if self.more:
+                rv += f' <a href="{escape(self.url(self.page_num + 1))}">{_("Next")}</a>'
+            rv += '</p>\n'
+        return rv
+
+
+def search_page(request, search_txt, page_num=1, page_size=SEARCH_PAGE_SIZE, path=None):
+    # Scored top-k search. Only the hits up to the requested page are loaded, the pages which are not readable by the
+    # user are skipped with one query per search round.
+    backend = get_backend()
+    start_queue_worker(backend)
+    ix = backend.load_index()
+    q = parse_query(search_txt)
+    if q is None:
+        return None
+    if path is not None:
+        # the empty path is the whole tree
+        path = path.strip("/") or None
+    page_size = min(max(page_size, 1), SEARCH_MAX_PAGE_SIZE)
+    key = cache.search_key(request, (normalize_query(search_txt), path), (backend.name, backend.index_version(ix)), page_num, page_size)
+    rv = cache.get_search(key)
+    if rv is not None:
+        return rv
+    # one more hit than needed shows, if there is a next page
+    needed = page_num * page_size + 1
+    limit = needed
+    while True:
+        results = backend.search(ix, q, limit, path)
+        if results is None:
+            return None
+        readable = set(
+            readable_pages(
+                request, PikiPage.objects.filter(rel_path__in=[rel_path for rel_path, hit in results], deleted=False)
+            ).values_list("rel_path", flat=True)
+        )
+        hits = [[rel_path, hit] for rel_path, hit in results if rel_path in readable]
+        if len(hits) >= needed or len(results) < limit:
+            break
+        limit *= 2
+    rv = search_result(search_txt, page_num, page_size, len(hits) >= needed, path)
+    for rel_path, hit in hits[(page_num - 1) * page_size:page_num * page_size]:
+        rv.append([rel_path, backend.highlights(ix, hit)])
+    cache.set_search(key, rv, is_relative(q))
+    return rv
+
+
+#
+# Search index updates of the edit path
+#
+# The changed rel_paths are stored in SearchIndexQueue and a background thread brings their documents in line with
+# the database. Repeated changes of a page are joined to one entry, entries left over at shutdown are processed after
+# the next start.
+#
+# Seconds between two looks at the queue, if no change is signalled
+QUEUE_POLL_INTERVAL = 60
+# Seconds until the next try, if the index is locked by another writer
+QUEUE_RETRY_INTERVAL = 5
+QUEUE_BATCH_SIZE = 200
+
+_worker_lock = threading.Lock()
+_worker = None
+
+
+def queue_update(*rel_paths):
+    backend = get_backend()
+    if backend.transactional:
+        # already done by page_saved
+        return
+    if not pages.parameter.get(pages.parameter.SEARCH_INDEX_ASYNC):
+        try:
+            backend.index_pages(backend.load_index(), rel_paths)
+            return
+        except index.LockError:
+            logger.warning('The search index is locked, the update of %d pages is queued.', len(rel_paths))
+        except Exception:
+            # the page is saved anyway, rebuild_index --incremental brings the index in line
+            logger.exception('Updating the search index failed for %s.', repr(rel_paths))
+            return
+    queued_time = datetime.now(tz=ZoneInfo("UTC"))
+    for rel_path in rel_paths:
+        SearchIndexQueue.objects.update_or_create(rel_path=rel_path, defaults={"queued_time": queued_time})
+    transaction.on_commit(wake_worker)
+
+
+def process_queue(batch_size=QUEUE_BATCH_SIZE):
+    # Index the oldest queued pages with one commit, returns the number of processed entries. With LockError (another
+    # writer holds the index) the entries stay in the queue, other errors would repeat, these entries are dropped.
+    entries = list(SearchIndexQueue.objects.order_by("queued_time").values_list("rel_path", "queued_time")[:batch_size])
+    if len(entries) > 0:
+        backend = get_backend()
+        try:
+            backend.index_pages(backend.load_index(), [rel_path for rel_path, queued_time in entries])
+        except index.LockError:
+            raise
+        except Exception:
+            # rebuild_index --incremental brings the index in line
+            logger.exception('Updating the search index failed for %d pages, they are removed from the queue.', len(entries))
+        # entries which were queued again in the meantime stay in the queue
+        SearchIndexQueue.objects.filter(
+            reduce(operator.or_, [Q(rel_path=rel_path, queued_time=queued_time) for rel_path, queued_time in entries])
+        ).delete()
+    return len(entries)
+
+
+class index_worker(threading.Thread):
+    def __init__(self):
+        super().__init__(name="search-index-worker", daemon=True)
+        self.wakeup = threading.Event()
+        # process the entries left over from a previous run
+        self.wakeup.set()
+
+    def run(self):
+        timeout = QUEUE_POLL_INTERVAL
+        while True:
+            self.wakeup.wait(timeout=timeout)
+            # collect further changes before writing
+            time.sleep(pages.parameter.get(pages.parameter.SEARCH_INDEX_DELAY))
+            self.wakeup.clear()
+            timeout = self.process()
+
+    def process(self):
+        # Process the queue, returns the seconds to wait for the next run, if no change is signalled
+        try:
+            while process_queue() > 0:
+                pass
+        except index.LockError:
+            logger.warning('The search index is locked, retrying in %d seconds.', QUEUE_RETRY_INTERVAL)
+            return QUEUE_RETRY_INTERVAL
+        except Exception:
+            logger.exception('Updating the search index failed, retrying later.')
+        finally:
+            connection.close()
+        return QUEUE_POLL_INTERVAL
+
+
+def start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = index_worker()
+            _worker.start()
+        return _worker
+
+
+def start_queue_worker(backend):
+    # process entries left over from a previous run
+    if pages.parameter.get(pages.parameter.SEARCH_INDEX_ASYNC) and not backend.transactional:
+        start_worker()
 
 
-def update_item(pp: PikiPage):
-    ix = load_index()
-    delete_item(ix, pp)
-    add_item(ix, pp)
+def wake_worker():
+    start_worker().wakeup.set()
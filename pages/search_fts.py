@@ -0,0 +1,260 @@
+from datetime import datetime
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from html import escape
+import logging
+import re
+from whoosh import query
+from zoneinfo import ZoneInfo
+
+from . import cache
+from .models import PikiPage
+from .search import document_data, search_backend
+
+logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
+
+
+#
+# SQLite FTS5 search backend
+#
+# The documents are stored in an FTS5 table of the page database (created by a migration) with the page id as rowid.
+# Queries are parsed by the Whoosh query parser (same syntax as the Whoosh backend) and translated to an FTS5 MATCH
+# expression and SQL conditions on the page table (dates, id) and the FTS table (wildcards).
+#
+FTS_TABLE = "pages_fts"
+TEXT_FIELDS = ["title", "page_src", "tag", "modified_user"]
+DATE_FIELDS = ["creation_time", "modified_time"]
+# changes with every change of the FTS table
+VERSION_KEY = "fts-version-%s"
+# marks of the matches in a snippet, replaced after html escaping
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+SNIPPET_TOKENS = 24
+
+
+# the page and its subpages (range condition to use the index of rel_path, "0" follows "/")
+SUBTREE_SQL = "p.rel_path = %s OR (p.rel_path >= %s AND p.rel_path < %s)"
+
+
+def subtree_params(path):
+    return [path, path + "/", path + "0"]
+
+
+class unsupported_query(Exception):
+    pass
+
+
+def quote(txt):
+    return '"' + txt.replace('"', '""') + '"'
+
+
+class fts5_backend(search_backend):
+    name = "fts5"
+    transactional = True
+
+    def __init__(self, table=FTS_TABLE):
+        self.table = table
+
+    def changed(self):
+        transaction.on_commit(lambda: cache.renew_token(VERSION_KEY % self.table))
+
+    def create_index(self):
+        with connection.cursor() as c:
+            c.execute(f"DELETE FROM {self.table}")
+        self.changed()
+        logger.debug('Search Index created.')
+        return self
+
+    def load_index(self, upgrade=True):
+        return self
+
+    def index_version(self, ix):
+        return cache.token(VERSION_KEY % self.table)
+
+    def row(self, pp: PikiPage):
+        data = document_data(pp)
+        return [
+            pp.id, data["id"], data["title"], data["page_src"], data["tag"], data["modified_user"],
+            None if data["modified_time"] is None else data["modified_time"].isoformat()
+        ]
+
+    def insert(self, cursor, rows):
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {self.table} (rowid, rel_path, title, page_src, tag, modified_user, modified_time) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)", rows
+        )
+
+    def rebuild_index(self, ix, procs=1, limitmb=128, chunk_size=500):
+        n = 0
+        with transaction.atomic(), connection.cursor() as c:
+            c.execute(f"DELETE FROM {self.table}")
+            rows = []
+            for pp in PikiPage.objects.filter(deleted=False).select_related("modified_user").iterator(chunk_size=chunk_size):
+                rows.append(self.row(pp))
+                if len(rows) >= chunk_size:
+                    self.insert(c, rows)
+                    n += len(rows)
+                    rows = []
+            self.insert(c, rows)
+            n += len(rows)
+            logger.info('Committing %d documents to the search index.', n)
+            self.changed()
+        return n
+
+    def indexed_times(self, ix):
+        with connection.cursor() as c:
+            c.execute(f"SELECT rel_path, modified_time FROM {self.table}")
+            return {
+                rel_path: None if modified_time is None else datetime.fromisoformat(modified_time)
+                for rel_path, modified_time in c.fetchall()
+            }
+
+    def index_pages(self, ix, rel_paths):
+        pps = list(PikiPage.objects.filter(rel_path__in=rel_paths).select_related("modified_user"))
+        found = set(pp.rel_path for pp in pps if not pp.deleted)
+        with transaction.atomic(), connection.cursor() as c:
+            for pp in pps:
+                if pp.deleted:
+                    logger.info('Removing document with id=%s from the search index.', pp.rel_path)
+                    c.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [pp.id])
+            self.insert(c, [self.row(pp) for pp in pps if not pp.deleted])
+            for rel_path in rel_paths:
+                if rel_path not in found:
+                    # document of a page which is not available under this path anymore
+                    c.execute(f"DELETE FROM {self.table} WHERE rel_path = %s", [rel_path])
+            self.changed()
+
+    def add_item(self, ix, pp: PikiPage):
+        logger.info('Adding document with id=%s to the search index.', pp.rel_path)
+        with connection.cursor() as c:
+            self.insert(c, [self.row(pp)])
+        self.changed()
+
+    def delete_item(self, ix, pp: PikiPage):
+        logger.info('Removing document with id=%s from the search index.', pp.rel_path)
+        with connection.cursor() as c:
+            c.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [pp.id])
+        self.changed()
+
+    #
+    # Query translation
+    #
+    def translate(self, q):
+        # [match, sql, params] with the meaning "MATCH match AND sql" (None for an omitted part)
+        if isinstance(q, query.Term) and q.fieldname in TEXT_FIELDS:
+            return [f"{q.fieldname} : {quote(q.text)}", None, []]
+        elif isinstance(q, query.Term) and q.fieldname == "id":
+            return [None, "p.rel_path = %s", [q.text]]
+        elif isinstance(q, query.Term) and q.fieldname == "path":
+            return [None, SUBTREE_SQL, subtree_params(q.text)]
+        elif isinstance(q, query.Phrase) and q.fieldname in TEXT_FIELDS:
+            return [f"{q.fieldname} : {quote(' '.join(q.words))}", None, []]
+        elif isinstance(q, query.Prefix) and q.fieldname in TEXT_FIELDS:
+            return [f"{q.fieldname} : {quote(q.text)} *", None, []]
+        elif isinstance(q, query.Wildcard) and q.fieldname in TEXT_FIELDS:
+            # FTS5 only knows prefixes, the words are checked by a regular expression (REGEXP is provided by Django)
+            prefix = re.split(r"[*?]", q.text)[0]
+            pattern = "".join("\\w*" if c == "*" else "\\w" if c == "?" else re.escape(c) for c in q.text)
+            return [
+                None if prefix == "" else f"{q.fieldname} : {quote(prefix)} *",
+                f"{self.table}.{q.fieldname} REGEXP %s",
+                [f"(?i)(?<!\\w){pattern}(?!\\w)"]
+            ]
+        elif isinstance(q, query.DateRange) and q.fieldname in DATE_FIELDS:
+            conditions = []
+            params = []
+            if q.startdate is not None:
+                conditions.append(f"p.{q.fieldname} {'>' if q.startexcl else '>='} %s")
+                params.append(self.db_datetime(q.startdate))
+            if q.enddate is not None:
+                conditions.append(f"p.{q.fieldname} {'<' if q.endexcl else '<='} %s")
+                params.append(self.db_datetime(q.enddate))
+            return [None, " AND ".join(conditions) or None, params]
+        elif isinstance(q, query.And):
+            parts = [self.translate(subquery) for subquery in q.subqueries]
+            matches = [match for match, sql, params in parts if match is not None]
+            sqls = [sql for match, sql, params in parts if sql is not None]
+            return [
+                " AND ".join(f"({match})" for match in matches) or None,
+                " AND ".join(f"({sql})" for sql in sqls) or None,
+                [param for match, sql, params in parts for param in params]
+            ]
+        elif isinstance(q, query.Or):
+            parts = [self.translate(subquery) for subquery in q.subqueries]
+            if all(sql is None for match, sql, params in parts) and all(match is not None for match, sql, params in parts):
+                return [" OR ".join(f"({match})" for match, sql, params in parts), None, []]
+            sqls = [self.as_sql(part) for part in parts]
+            return [None, " OR ".join(f"({sql})" for sql, params in sqls), [param for sql, params in sqls for param in params]]
+        elif isinstance(q, query.Not):
+            sql, params = self.as_sql(self.translate(q.query))
+            return [None, f"NOT ({sql})", params]
+        elif isinstance(q, query.AndNot):
+            return self.translate(query.And([q.a, query.Not(q.b)]))
+        elif isinstance(q, query.AndMaybe):
+            # the optional part only changes the scoring
+            return self.translate(q.a)
+        elif isinstance(q, query.Every):
+            return [None, None, []]
+        elif isinstance(q, type(query.NullQuery)):
+            return [None, "0", []]
+        raise unsupported_query(repr(q))
+
+    def as_sql(self, part):
+        # a translated part as sql condition only
+        match, sql, params = part
+        conditions = []
+        sql_params = []
+        if match is not None:
+            conditions.append(f"p.id IN (SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s)")
+            sql_params.append(match)
+        if sql is not None:
+            conditions.append(f"({sql})")
+            sql_params.extend(params)
+        return " AND ".join(conditions) or "1", sql_params
+
+    def db_datetime(self, dtm):
+        # the date parser creates naive datetimes in UTC
+        if dtm.tzinfo is None:
+            dtm = dtm.replace(tzinfo=ZoneInfo("UTC"))
+        return connection.ops.adapt_datetimefield_value(dtm)
+
+    def search(self, ix, q, limit, path=None):
+        if path is not None:
+            q = query.And([q, query.Term("path", path)])
+        try:
+            match, sql, params = self.translate(q)
+        except unsupported_query as e:
+            logger.info('Query %s is not supported by the fts5 search backend.', str(e))
+            return None
+        conditions = ["p.deleted = 0"]
+        sql_params = []
+        if match is not None:
+            conditions.append(f"{self.table} MATCH %s")
+            sql_params.append(match)
+            snippet = f"snippet({self.table}, 2, %s, %s, '...', {SNIPPET_TOKENS})"
+            snippet_params = [MATCH_START, MATCH_END]
+            order = "rank"
+        else:
+            snippet = f"substr({self.table}.page_src, 1, {SNIPPET_TOKENS * 8})"
+            snippet_params = []
+            order = "p.modified_time DESC"
+        if sql is not None:
+            conditions.append(f"({sql})")
+            sql_params.extend(params)
+        statement = (
+            f"SELECT {self.table}.rel_path, {snippet} FROM {self.table} "
+            f"JOIN {PikiPage._meta.db_table} p ON p.id = {self.table}.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT %s"
+        )
+        try:
+            with transaction.atomic(), connection.cursor() as c:
+                c.execute(statement, snippet_params + sql_params + [-1 if limit is None else limit])
+                return [[rel_path, snippet] for rel_path, snippet in c.fetchall()]
+        except DatabaseError as e:
+            logger.info('Query %s failed in the fts5 search backend: %s', repr(match), str(e))
+            return None
+
+    def highlights(self, ix, hit):
+        html = escape(hit or "", quote=False)
+        return html.replace(MATCH_START, '<b class="match term0">').replace(MATCH_END, '</b>')
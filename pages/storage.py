@@ -0,0 +1,155 @@
+from django.conf import settings
+
+import hashlib
+import json
+import logging
+import zlib
+
+from .diff import patience_matcher
+import pages.parameter
+
+logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
+
+
+#
+# Content addressed blob storage for the page text
+#
+# Every page text is stored once in PikiPageBlob, referenced by PikiPage and its history. With HISTORY_DELTA, the blob
+# of an older version can be stored as reverse delta to the blob of the next newer version. Every
+# HISTORY_KEYFRAME_INTERVAL-th version stays complete to limit the effort of reconstruction.
+#
+def blob_digest(txt):
+    return hashlib.sha256(txt.encode("utf-8")).hexdigest()
+
+
+def store_blob(txt):
+    from .models import PikiPageBlob
+    #
+    digest = blob_digest(txt)
+    PikiPageBlob.objects.get_or_create(digest=digest, defaults={"data": zlib.compress(txt.encode("utf-8"))})
+    return digest
+
+
+def blob_page_txt(digest):
+    from .models import PikiPageBlob
+    #
+    # collect the deltas up to the next complete blob
+    deltas = []
+    while True:
+        data, base = PikiPageBlob.objects.values_list("data", "base").get(digest=digest)
+        if base is None:
+            page_txt = zlib.decompress(bytes(data)).decode("utf-8")
+            break
+        deltas.append(bytes(data))
+        digest = base
+    for delta in reversed(deltas):
+        page_txt = apply_delta(page_txt, delta)
+    return page_txt
+
+
+def history_page_txt(h_page):
+    if h_page.page_blob_id is None:
+        return h_page.page_txt
+    return blob_page_txt(h_page.page_blob_id)
+
+
+def make_delta(txt, base):
+    # list of [start, end] line ranges of base and inserted strings which result in txt
+    base_lines = base.splitlines(keepends=True)
+    lines = txt.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in patience_matcher(base_lines, lines).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(lines[j1:j2]))
+    return zlib.compress(json.dumps(ops).encode("utf-8"))
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(keepends=True)
+    rv = ""
+    for op in json.loads(zlib.decompress(delta).decode("utf-8")):
+        if isinstance(op, list):
+            rv += "".join(base_lines[op[0]:op[1]])
+        else:
+            rv += op
+    return rv
+
+
+def version_digests(page, limit=None):
+    # blob digests of the page versions (newest first), versions with the same text are joined
+    rv = []
+    for digest in page.history.order_by("-history_id").values_list("page_blob", flat=True).iterator():
+        if digest is not None and (len(rv) == 0 or rv[-1] != digest):
+            rv.append(digest)
+            if limit is not None and len(rv) >= limit:
+                break
+    return rv
+
+
+def reaches(digest, target):
+    from .models import PikiPageBlob
+    #
+    while digest is not None:
+        if digest == target:
+            return True
+        digest = PikiPageBlob.objects.values_list("base", flat=True).get(digest=digest)
+    return False
+
+
+def compress_history(page):
+    from .models import PikiPageBlob
+    #
+    # Store the blob of the previous version as delta to the current one, if it is not a keyframe
+    interval = pages.parameter.get(pages.parameter.HISTORY_KEYFRAME_INTERVAL)
+    digests = version_digests(page, interval + 1)
+    if len(digests) < 2:
+        return
+    current, previous = digests[:2]
+    bases = dict(PikiPageBlob.objects.filter(digest__in=digests).values_list("digest", "base"))
+    if bases.get(current) is not None or bases.get(previous) is not None:
+        # only complete blobs can be linked (this prevents cycles)
+        return
+    deltas = 0
+    for digest in digests[2:]:
+        if bases.get(digest) is None:
+            break
+        deltas += 1
+    if deltas >= interval - 1:
+        logger.debug("Text %s of page %s stays complete as keyframe", previous, repr(page.rel_path))
+    else:
+        data = PikiPageBlob.objects.values_list("data", flat=True).get(digest=previous)
+        previous_txt = zlib.decompress(bytes(data)).decode("utf-8")
+        # the delta is an optimisation, the edit must not fail because of it
+        try:
+            delta = make_delta(previous_txt, page.page_txt)
+            if apply_delta(page.page_txt, delta) != previous_txt:
+                raise ValueError("delta does not reproduce the text")
+        except Exception:
+            logger.exception("Text %s of page %s stays complete, no delta could be created", previous, repr(page.rel_path))
+            return
+        PikiPageBlob.objects.filter(digest=previous).update(data=delta, base=current)
+        logger.debug("Text %s of page %s stored as delta (%d bytes)", previous, repr(page.rel_path), len(delta))
+
+
+def convert_history(page, delta):
+    from .models import PikiPageBlob
+    #
+    # Convert the blobs of all versions of page to delta storage (delta=True) or complete storage (delta=False)
+    interval = pages.parameter.get(pages.parameter.HISTORY_KEYFRAME_INTERVAL)
+    converted = 0
+    newer = None
+    for index, digest in enumerate(version_digests(page)):
+        page_txt = blob_page_txt(digest)
+        base = PikiPageBlob.objects.values_list("base", flat=True).get(digest=digest)
+        if delta and index % interval != 0:
+            if base is None and not reaches(newer, digest):
+                PikiPageBlob.objects.filter(digest=digest).update(data=make_delta(page_txt, newer_txt), base=newer)
+                converted += 1
+        elif base is not None:
+            PikiPageBlob.objects.filter(digest=digest).update(data=zlib.compress(page_txt.encode("utf-8")), base=None)
+            converted += 1
+        newer = digest
+        newer_txt = page_txt
+    return converted
@@ -1,3 +1,1122 @@
-from django.test import TestCase
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from datetime import datetime, timedelta
+import difflib
+from io import StringIO
+import re
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from whoosh import index as whoosh_index
+from whoosh import query
+from whoosh.fields import Schema
+from whoosh.index import LockError
+from zoneinfo import ZoneInfo
+
+import config
+import mycreole
+
+from . import autocomplete
+from . import cache
+from .autocomplete import complete
+from . import diff
+from . import search
+from . import url_page
+from . import storage
+from .admin import PikiPageAdmin
+from .access import access_control, permission_profile, readable_pages, read_attachment, modify_attachment
+from .models import (
+    BLOCK_MIN_SIZE, ListingChange, PikiPage, PikiPageBlob, RenderDependency, SearchIndexQueue, creole_blocks, get_page, prefix_range
+)
+from .search import ancestor_paths, create_index, parse_query, search_page, whoosh_backend
+from .search_fts import fts5_backend
+
+
+def parameters(**values):
+    # pages.parameter takes config before settings, the values are set in config
+    return mock.patch.multiple(config, create=True, **values)
+
+
+# The tests must not touch the persistent caches of the installation
+TEST_CACHES = {
+    alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "piki-tests-%s" % alias}
+    for alias in ["default", "pages", "sessions", "blocks", "search"]
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PikiTestCase(TestCase):
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        # process wide state, which is built from the database or depends on the time
+        for patcher in [mock.patch.object(autocomplete, "_index", None), mock.patch.dict(search._queries, clear=True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class PageTreeTests(PikiTestCase):
+    def add_pages(self, *rel_paths, deleted=False):
+        dtm = datetime.now(ZoneInfo("UTC"))
+        for rel_path in rel_paths:
+            PikiPage(rel_path=rel_path, page_txt="", deleted=deleted, creation_time=dtm, modified_time=dtm).save()
+
+    def tree_html(self):
+        return PikiPage(rel_path="tree").macro_allpagestree()
+
+    def test_constant_number_of_queries(self):
+        self.add_pages("a", "a/b", "c")
+        with self.assertNumQueries(1):
+            self.tree_html()
+        self.add_pages(*["d/%d/%d" % (i, j) for i in range(10) for j in range(5)])
+        with self.assertNumQueries(1):
+            self.tree_html()
+
+    def test_deleted_pages_are_skipped(self):
+        self.add_pages("a", "a/b")
+        self.add_pages("a/c", "x", deleted=True)
+        html = self.tree_html()
+        self.assertIn(">b</a>", html)
+        self.assertNotIn("── c", html)
+        self.assertNotIn("── x", html)
+
+    def test_subpagetree_links_the_ancestors(self):
+        self.add_pages("team/ops", "team/ops/a", "team/ops/b/c", "team/opsfoo")
+        dtm = datetime.now(ZoneInfo("UTC"))
+        PikiPage(rel_path="team", page_txt="", other_perms_read=False, creation_time=dtm, modified_time=dtm).save()
+        page = PikiPage.objects.get(rel_path="team/ops")
+        page._render_request = RequestFactory().get("/page/team/ops")
+        page._render_request.user = AnonymousUser()
+        with self.assertNumQueries(1):
+            html = page.macro_subpagetree()
+        self.assertIn('<a href="%s">ops</a>' % url_page("team/ops"), html)
+        self.assertIn('<a href="%s">a</a>' % url_page("team/ops/a"), html)
+        self.assertIn("── b\n", html)
+        # not readable
+        self.assertIn("── team\n", html)
+        self.assertNotIn("opsfoo", html)
+
+
+class PrefixQueryTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        for rel_path in ["hub", "hub/a", "hub/a/b", "Hub/c", "hubx", "hub0"]:
+            PikiPage(rel_path=rel_path, page_txt="", creation_time=dtm, modified_time=dtm).save()
+
+    def test_prefix_is_case_sensitive(self):
+        rel_paths = PikiPage.objects.filter(**prefix_range("hub/")).values_list("rel_path", flat=True)
+        self.assertEqual(sorted(rel_paths), ["hub/a", "hub/a/b"])
+        rel_paths = PikiPage.objects.filter(**prefix_range("hub")).values_list("rel_path", flat=True)
+        self.assertEqual(sorted(rel_paths), ["hub", "hub/a", "hub/a/b", "hub0", "hubx"])
+
+    def test_prefix_uses_the_index(self):
+        plan = PikiPage.objects.filter(deleted=False, **prefix_range("hub/")).only("rel_path").explain()
+        self.assertIn("USING INDEX", plan)
+        self.assertNotIn("SCAN", plan)
+
+
+class HierarchyTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        for rel_path in ["hub", "hub/b", "hub/a", "hub/a/x", "hubx/c", "top"]:
+            PikiPage(rel_path=rel_path, page_txt="", creation_time=dtm, modified_time=dtm).save()
+
+    def test_children_by_parent_path(self):
+        with CaptureQueriesContext(connection) as queries:
+            html = PikiPage.objects.get(rel_path="hub").macro_subpages(**{"": "1"})
+        self.assertIn('"parent_path" = ', queries[-1]["sql"])
+        self.assertLess(html.index("hub/a"), html.index("hub/b"))
+        self.assertNotIn("hub/a/x", html)
+        self.assertNotIn("hubx", html)
+
+    def test_top_level_pages(self):
+        html = PikiPage(rel_path="index").macro_allpages(**{"": "1"})
+        self.assertIn("/page/hub", html)
+        self.assertIn("/page/top", html)
+        self.assertNotIn("/page/hub/", html)
+        self.assertNotIn("/page/hubx/", html)
+
+    def test_rename_updates_the_hierarchy(self):
+        page = PikiPage.objects.get(rel_path="hub/a/x")
+        page.rel_path = "top/x"
+        page.save()
+        self.assertEqual(list(PikiPage.objects.filter(parent_path="top").values_list("basename", "depth")), [("x", 1)])
+
+
+class DirtyFieldSaveTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        PikiPage(rel_path="top/a", page_txt="text", tags="old", creation_time=dtm, modified_time=dtm).save()
+        self.page = PikiPage.objects.get(rel_path="top/a")
+
+    def updated_columns(self):
+        # columns written by the UPDATE of save()
+        with CaptureQueriesContext(connection) as ctx:
+            self.page.save()
+        updates = [query["sql"] for query in ctx.captured_queries if query["sql"].startswith('UPDATE "pages_pikipage"')]
+        self.assertEqual(len(updates), 1)
+        return set(re.findall(r'"(\w+)" = ', updates[0].split(" WHERE ")[0]))
+
+    def test_unchanged_page_is_not_saved(self):
+        self.page.modified_time = datetime.now(ZoneInfo("UTC")) + timedelta(days=1)
+        with self.assertNumQueries(0):
+            self.assertFalse(self.page.save())
+
+    def test_metadata_change(self):
+        self.page.tags = "new"
+        self.assertEqual(self.updated_columns(), {"tags"})
+        self.assertEqual(PikiPage.objects.get(rel_path="top/a").tags, "new")
+
+    def test_rel_path_change(self):
+        self.page.rel_path = "other/b"
+        self.assertEqual(self.updated_columns(), {"rel_path", "parent_path", "basename", "depth"})
+        self.assertEqual(PikiPage.objects.values_list("parent_path", "basename").get(rel_path="other/b"), ("other", "b"))
+
+    def test_text_change(self):
+        self.page.page_txt = "new text"
+        self.page.modified_time = datetime.now(ZoneInfo("UTC"))
+        self.assertEqual(self.updated_columns(), {"page_txt", "page_hash", "page_blob_id", "modified_time"})
+        page = PikiPage.objects.get(rel_path="top/a")
+        self.assertEqual(page.page_txt, "new text")
+        self.assertEqual(page.page_blob_id, storage.blob_digest("new text"))
+
+    def test_changes_after_save(self):
+        self.page.tags = "new"
+        self.page.save()
+        self.page.deleted = True
+        self.assertEqual(self.updated_columns(), {"deleted"})
+
+    def test_changes_after_refresh(self):
+        PikiPage.objects.filter(id=self.page.id).update(tags="other")
+        self.page.refresh_from_db()
+        self.page.tags = "old"
+        self.assertEqual(self.updated_columns(), {"tags"})
+        self.assertEqual(PikiPage.objects.get(rel_path="top/a").tags, "old")
+        # only the reloaded fields are taken as unchanged
+        PikiPage.objects.filter(id=self.page.id).update(tags="other")
+        self.page.deleted = True
+        self.page.refresh_from_db(fields=["tags"])
+        self.assertEqual(self.page.dirty_fields(), ["deleted"])
+        # deferred fields are loaded by refresh_from_db
+        page = PikiPage.objects.only("rel_path").get(rel_path="top/a")
+        self.assertEqual(page.tags, "other")
+        self.assertEqual(page.dirty_fields(), [])
+
+
+class RequestPageCacheTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        user = User.objects.create(username="owner")
+        PikiPage(rel_path="a", page_txt="", owner=user, creation_user=user, modified_user=user, creation_time=dtm, modified_time=dtm).save()
+        self.request = RequestFactory().get("/page/a")
+        self.request.user = AnonymousUser()
+
+    def test_one_query_per_page_and_request(self):
+        with self.assertNumQueries(1):
+            acc = access_control(self.request, "a")
+            acc.may_read()
+            acc.may_write()
+            read_attachment(self.request, "a/image.png")
+            modify_attachment(self.request, "a/image.png")
+            page = get_page(self.request, "a")
+            self.assertEqual(page.owner.username, "owner")
+            self.assertEqual(page.creation_user.username, "owner")
+            self.assertEqual(page.modified_user.username, "owner")
+            self.assertIsNone(page.group)
+
+    def test_attachment_access_per_directory(self):
+        read_attachment(self.request, "a/image0.png")
+        with self.assertNumQueries(0):
+            for index in range(50):
+                self.assertTrue(read_attachment(self.request, "a/image%d.png" % index))
+                self.assertFalse(modify_attachment(self.request, "a/image%d.png" % index))
+
+    def test_missing_pages_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_page(self.request, "b"))
+            self.assertFalse(access_control(self.request, "b").may_read())
+
+    def test_page_view(self):
+        # the page (with users and group) and the render dependencies of the page
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url_page("a")).status_code, 200)
+        # the page, the html is taken from the cache
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url_page("a")).status_code, 200)
+        # the page and the versions
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url_page("a", meta=None)).status_code, 200)
+
+
+class RenderCacheTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        self.owner = User.objects.create(username="owner")
+        self.users = [User.objects.create(username="user%d" % index) for index in range(10)]
+        self.page = PikiPage(rel_path="a", page_txt="= Text", owner=self.owner, creation_time=dtm, modified_time=dtm)
+        self.page.save()
+
+    def render(self, user):
+        request = RequestFactory().get("/page/a")
+        request.user = user
+        return PikiPage.objects.get(rel_path="a").render_to_html(request)
+
+    def test_users_share_the_effective_permission_class(self):
+        with mock.patch.object(mycreole, "render", wraps=mycreole.render) as render:
+            html = self.render(self.users[0])
+            self.assertEqual(render.call_count, 1)
+            for user in self.users:
+                self.assertEqual(self.render(user), html)
+            self.assertEqual(render.call_count, 1)
+            # the owner has write access to the attachments
+            self.render(self.owner)
+            self.assertEqual(render.call_count, 2)
+            self.render(AnonymousUser())
+            self.assertEqual(render.call_count, 3)
+
+    def test_changes_invalidate(self):
+        with mock.patch.object(mycreole, "render", wraps=mycreole.render) as render:
+            self.render(self.users[0])
+            self.page.page_txt = "= Other text"
+            self.page.save()
+            self.render(self.users[0])
+            self.assertEqual(render.call_count, 2)
+
+
+def render_macros(request, txt, rel_path, macros={}):
+    # mycreole replacement, which renders a text consisting of one macro
+    return macros[txt.strip("<>")]()
+
+
+class HistoryCacheTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        self.owner = User.objects.create(username="owner")
+        self.public = PikiPage(rel_path="public", page_txt="public text", creation_time=self.dtm, modified_time=self.dtm)
+        self.public.save()
+        self.secret = PikiPage(rel_path="secret", page_txt="TOP SECRET v1", owner=self.owner, creation_time=self.dtm, modified_time=self.dtm)
+        self.secret.save()
+        self.secret_history_id = self.secret.history.first().history_id
+
+    def request(self, user):
+        request = RequestFactory().get("/page/public")
+        request.user = user
+        return request
+
+    def test_versions_of_other_pages_are_not_served(self):
+        self.assertIn("TOP SECRET v1", self.secret.render_to_html(self.request(self.owner), self.secret_history_id))
+        self.secret.other_perms_read = False
+        self.secret.save()
+        with self.assertRaises(ObjectDoesNotExist):
+            self.public.render_to_html(self.request(AnonymousUser()), self.secret_history_id)
+        with self.assertRaises(ObjectDoesNotExist):
+            self.public.render_meta(self.request(AnonymousUser()), self.secret_history_id)
+
+    def test_versions_are_cached(self):
+        history_id = self.public.history.first().history_id
+        with mock.patch.object(mycreole, "render", wraps=mycreole.render) as render:
+            html = self.public.render_to_html(self.request(AnonymousUser()), history_id)
+            self.assertEqual(self.public.render_to_html(self.request(AnonymousUser()), history_id), html)
+            self.assertEqual(render.call_count, 1)
+
+    def test_meta_page_depends_on_the_timezone(self):
+        def userprofile(timezone):
+            return mock.patch("pages.models.get_userprofile", return_value=mock.Mock(timezone=timezone))
+        with userprofile("UTC"):
+            utc = self.public.render_meta(self.request(self.owner), None)
+        with userprofile("Asia/Tokyo"):
+            tokyo = self.public.render_meta(self.request(self.owner), None)
+        self.assertIn("2024-01-01 00:00:00+00:00", utc)
+        self.assertIn("2024-01-01 09:00:00+09:00", tokyo)
+
+
+class MetaHistoryTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(mycreole, "render_simple", side_effect=lambda txt: txt)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        self.page = PikiPage(rel_path="p", page_txt="a\nb", tags="", creation_time=dtm, modified_time=dtm)
+        self.page.save()
+        # line endings and trailing newline only, tags only, text only
+        for page_txt, tags in [("a\r\nb\n", ""), ("a\r\nb\n", "x"), ("a\nc", "x")]:
+            self.page.page_txt = page_txt
+            self.page.tags = tags
+            self.page.save()
+        self.history_ids = list(self.page.history.values_list("history_id", flat=True))
+
+    def rows(self, **params):
+        # [version, page changed, tags changed] of the history table and the pagination line
+        request = RequestFactory().get("/page/p", params)
+        request.user = AnonymousUser()
+        meta = self.page.render_meta(request, None)
+        rows = []
+        for line in meta.split("= History\n")[1].splitlines()[1:]:
+            cells = [cell.strip() for cell in line.split("|")]
+            if len(cells) > 6:
+                rows.append([cells[1], cells[-3], cells[-2]])
+        pagination = re.search(r"Page \d+ / \d+:.*", meta)
+        return rows, None if pagination is None else pagination.group(0)
+
+    def test_change_flags(self):
+        self.assertEqual(len(self.history_ids), 4)
+        rows, pagination = self.rows()
+        self.assertEqual(rows, [
+            ["Current", "Yes", "No"], [str(self.history_ids[1]), "No", "Yes"], [str(self.history_ids[2]), "---", "---"],
+        ])
+        self.assertIsNone(pagination)
+
+    def test_pagination(self):
+        rows, pagination = self.rows(history_size=1, history_page=2)
+        self.assertEqual(rows, [[str(self.history_ids[1]), "No", "Yes"]])
+        self.assertIn("Page 2 / 3:", pagination)
+        self.assertIn("Previous", pagination)
+        self.assertIn("Next", pagination)
+        # the last page holds the remaining versions, pages beyond the end show the last page
+        for page_num in [3, 99]:
+            rows, pagination = self.rows(history_size=2, history_page=page_num)
+            self.assertEqual(rows, [[str(self.history_ids[2]), "---", "---"]])
+            self.assertIn("Page 2 / 2:", pagination)
+            self.assertNotIn("Next", pagination)
+        rows, pagination = self.rows(history_size=3, history_page=0)
+        self.assertEqual(len(rows), 3)
+        self.assertIsNone(pagination)
+
+
+class ListingDependencyTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dtm = datetime.now(ZoneInfo("UTC"))
+        self.add("hub", "<<subpages>>")
+        self.add("hub/a", "")
+
+    def add(self, rel_path, page_txt):
+        PikiPage(rel_path=rel_path, page_txt=page_txt, creation_time=self.dtm, modified_time=self.dtm).save()
+
+    def render(self):
+        request = RequestFactory().get("/page/hub")
+        request.user = AnonymousUser()
+        return PikiPage.objects.get(rel_path="hub").render_to_html(request)
+
+    def test_changes_below_the_filter_invalidate(self):
+        with mock.patch.object(mycreole, "render", side_effect=render_macros) as render:
+            self.assertIn("hub/a", self.render())
+            self.assertEqual(list(RenderDependency.objects.values_list("filter_str", flat=True)), ["hub/"])
+            self.add("other", "")
+            self.render()
+            self.assertEqual(render.call_count, 1)
+            self.add("hub/b", "")
+            self.assertIn("hub/b", self.render())
+            self.assertEqual(render.call_count, 2)
+
+    def test_dependencies_follow_the_text(self):
+        with mock.patch.object(mycreole, "render", side_effect=render_macros):
+            self.render()
+            page = PikiPage.objects.get(rel_path="hub")
+            page.page_txt = "<<allpages>>"
+            page.save()
+            self.render()
+        self.assertEqual(list(RenderDependency.objects.values_list("filter_str", flat=True)), [""])
+
+
+def long_text(sections=12):
+    txt = ""
+    for index in range(sections):
+        txt += "= Section %d\n\nSome **bold\ntext** and a [[link]].\n\n" % index
+        txt += "* item\n** subitem\n\n|=a|=b|\n|1|2|\n\n"
+        txt += "{{{\ncode\n\n= no heading\n}}}\n\n"
+        txt += "//italic// paragraph " * 20 + "\n\n"
+    return txt
+
+
+class CreoleBlockTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().get("/page/a")
+        self.request.user = AnonymousUser()
+
+    def test_blocks_join_to_the_text(self):
+        txt = long_text()
+        blocks = creole_blocks(txt)
+        self.assertGreater(len(blocks), 1)
+        self.assertLess(len(blocks), len(txt) // BLOCK_MIN_SIZE + 2)
+        self.assertEqual("\n".join(blocks), txt)
+        for block in blocks[1:]:
+            self.assertTrue(block.startswith("= Section"))
+
+    def test_no_split_inside_preformatted_text_and_macros(self):
+        txt = "{{{\n" + "x\n\n= no heading\n" * BLOCK_MIN_SIZE + "}}}\n"
+        self.assertEqual(creole_blocks(txt), [txt])
+        txt = long_text() + "<<toc>>"
+        self.assertEqual(creole_blocks(txt), [txt])
+
+    def test_block_rendering_equals_whole_text_rendering(self):
+        def normalize(html):
+            return re.sub(r">\s+<", "><", html).strip()
+        for txt in [long_text(), long_text(1), "= Title\n\ntext"]:
+            page = PikiPage(rel_path="a")
+            self.assertEqual(normalize(page.render_text(self.request, txt)), normalize(mycreole.render(self.request, txt, "a")))
+            # again from the block cache
+            self.assertEqual(normalize(page.render_text(self.request, txt)), normalize(mycreole.render(self.request, txt, "a")))
+
+    def test_changed_blocks_are_rendered(self):
+        txt = long_text()
+        page = PikiPage(rel_path="a")
+        with mock.patch.object(mycreole, "render", wraps=mycreole.render) as render:
+            page.render_text(self.request, txt)
+            cold = render.call_count
+            page.render_text(self.request, txt.replace("Section 3", "Section three"))
+            self.assertEqual(render.call_count, cold + 1)
+
+
+def apply_opcodes(sm, a, b):
+    rv = []
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        rv.extend(a[i1:i2] if tag == "equal" else b[j1:j2])
+    return rv
+
+
+class DiffTests(SimpleTestCase):
+    def test_opcodes_transform_the_lines(self):
+        a = ["x", "", "a", "", "b", "", "c"]
+        b = ["", "a", "new", "", "c", "", "x"]
+        self.assertEqual(apply_opcodes(diff.patience_matcher(a, b), a, b), b)
+
+    def test_inserted_block(self):
+        a = ["void a() {", "  x();", "}", "", "void c() {", "  z();", "}"]
+        b = ["void a() {", "  x();", "}", "", "void b() {", "  y();", "}", "", "void c() {", "  z();", "}"]
+        sm = diff.patience_matcher(a, b)
+        self.assertEqual(sm.get_opcodes(), [("equal", 0, 4, 0, 4), ("insert", 4, 4, 4, 8), ("equal", 4, 7, 8, 11)])
+
+    def test_large_regions_without_anchors_are_replaced(self):
+        a = ["", "|a|b|", "----"] * 1000
+        b = ["|a|b|", "----", ""] * 1000
+        sm = diff.patience_matcher(a, b)
+        self.assertEqual(sm.get_opcodes(), [("replace", 0, 3000, 0, 3000)])
+
+    def test_html_table(self):
+        self.assertEqual(diff.html_table(["a"], ["a"], "left", "right"), diff.NO_CHANGES)
+        html = diff.html_table(["a", "<b>", "c"], ["a", "<x>", "c"], "left", "right")
+        self.assertIn('<span class="diff_sub">&lt;b&gt;</span>', html)
+        self.assertIn('<span class="diff_add">&lt;x&gt;</span>', html)
+        self.assertIn('<td class="diff_header">2</td>', html)
+
+    def test_unified(self):
+        self.assertEqual(diff.unified(["a"], ["a"], "left", "right"), diff.NO_CHANGES)
+        html = diff.unified(["a", "b", "c", "d", "e"], ["a", "b", "X", "d", "e"], "left", "right")
+        self.assertIn("--- left\n+++ right\n@@ -1,5 +1,5 @@\n a\n b\n-c\n+X\n d\n e\n", html)
+
+    def test_unified_hunk_ranges(self):
+        # same hunk headers as difflib, also for empty ranges (pure insertions and deletions)
+        for a, b in [
+            ([], ["x"]), (["x"], []), (["a", "b"], ["a", "x", "b"]), (["a", "x", "b"], ["a", "b"]), (["a"], ["b"]),
+            (list("abcdefghij"), list("abcdXefghij")), (list("abcdefghij"), list("abcdefghi")),
+        ]:
+            expected = [line for line in difflib.unified_diff(a, b, lineterm="") if line.startswith("@@")]
+            self.assertEqual(re.findall(r"^@@ .* @@$", diff.unified(a, b, "left", "right"), re.M), expected)
+
+    def test_nested_unique_lines(self):
+        # every unique line encloses the next level, which was one recursion level each
+        a = []
+        b = []
+        for k in range(1100, 0, -1):
+            a += ["u%d" % k, "u%d" % (k + 1)]
+            b += ["u%d" % k]
+        self.assertEqual(apply_opcodes(diff.patience_matcher(a, b), a, b), b)
+        self.assertIn("diff_sub", diff.html_table(a, b, "left", "right"))
+        a_txt = "\n".join(a)
+        b_txt = "\n".join(b)
+        self.assertEqual(storage.apply_delta(b_txt, storage.make_delta(a_txt, b_txt)), a_txt)
+
+
+class HistoryDeltaTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = parameters(HISTORY_DELTA=True, HISTORY_KEYFRAME_INTERVAL=4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        lines = ["line %d\r\n" % index for index in range(50)]
+        self.page = PikiPage(rel_path="a", page_txt="".join(lines), creation_time=self.dtm, modified_time=self.dtm)
+        self.page.save()
+        self.texts = [self.page.page_txt]
+        for index in range(12):
+            lines[(index * 7) % 50] = "changed %d\r\n" % index
+            if index == 5:
+                lines.insert(10, "inserted\n")
+            self.page.page_txt = "".join(lines)
+            self.page.modified_time = self.dtm + timedelta(days=index + 1)
+            self.page.save()
+            self.texts.append(self.page.page_txt)
+
+    def assert_versions(self):
+        history_ids = self.page.history.order_by("history_id").values_list("history_id", flat=True)
+        self.assertEqual([self.page.get_history(history_id).page_txt for history_id in history_ids], self.texts)
+
+    def test_versions_are_stored_as_deltas(self):
+        self.assert_versions()
+        bases = list(PikiPageBlob.objects.values_list("base", flat=True))
+        self.assertGreater(len([base for base in bases if base is not None]), len(self.texts) // 2)
+        # every HISTORY_KEYFRAME_INTERVAL-th version stays complete
+        self.assertGreaterEqual(bases.count(None), len(self.texts) // 4)
+
+    def test_delta_round_trip(self):
+        base = "a\nb\r\nc\n\nd"
+        for txt in ["", base, "a\nc\n", "x\na\nb\r\nc\n\nd\ny", "b\r\n\n\nd\n", "no newline"]:
+            self.assertEqual(storage.apply_delta(base, storage.make_delta(txt, base)), txt)
+            self.assertEqual(storage.apply_delta(txt, storage.make_delta(base, txt)), base)
+
+    def test_equal_texts_share_a_blob(self):
+        blobs = PikiPageBlob.objects.count()
+        page = PikiPage(rel_path="b", page_txt=self.texts[-1], creation_time=self.dtm, modified_time=self.dtm)
+        page.save()
+        self.assertEqual(page.page_blob_id, self.page.page_blob_id)
+        self.assertEqual(PikiPageBlob.objects.count(), blobs)
+
+    def test_historical_instance_has_the_page_txt(self):
+        # the admin area reverts a version by saving its instance
+        h_page = self.page.history.order_by("history_id").first()
+        self.assertEqual(h_page.page_txt, "")
+        self.assertEqual(h_page.history_object.page_txt, self.texts[0])
+        page = h_page.instance
+        self.assertEqual(page.page_txt, self.texts[0])
+        page.save()
+        self.assertEqual(PikiPage.objects.get(rel_path="a").page_txt, self.texts[0])
+
+    def test_failed_delta_keeps_the_text_complete(self):
+        with mock.patch.object(storage, "make_delta", side_effect=RecursionError()), self.assertLogs(level="ERROR"):
+            self.page.page_txt = "new\n"
+            self.page.modified_time = self.dtm + timedelta(days=100)
+            self.page.save()
+        self.texts.append("new\n")
+        self.assertEqual(PikiPage.objects.get(rel_path="a").page_txt, "new\n")
+        self.assertIsNone(PikiPageBlob.objects.get(digest=storage.blob_digest(self.texts[-2])).base)
+        self.assert_versions()
+
+    def test_verify_page_blobs(self):
+        stdout = StringIO()
+        call_command("verify_page_blobs", stdout=stdout)
+        self.assertIn("blobs verified", stdout.getvalue())
+        blob = PikiPageBlob.objects.filter(base__isnull=False).first()
+        blob.data = storage.make_delta("corrupted\n", "")
+        blob.save()
+        with self.assertRaises(CommandError):
+            call_command("verify_page_blobs", stdout=StringIO())
+
+    def test_convert_history(self):
+        self.assertGreater(storage.convert_history(self.page, False), 0)
+        self.assertEqual(PikiPageBlob.objects.filter(base__isnull=False).count(), 0)
+        self.assert_versions()
+        self.assertGreater(storage.convert_history(self.page, True), 0)
+        self.assertGreater(PikiPageBlob.objects.filter(base__isnull=False).count(), 0)
+        self.assert_versions()
+        # converting again changes nothing
+        self.assertEqual(storage.convert_history(self.page, True), 0)
+
+
+class AdminActionTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        self.owner = User.objects.create(username="owner")
+        self.member = User.objects.create(username="member")
+        self.group = Group.objects.create(name="team")
+        self.member.groups.add(self.group)
+        PikiPage(
+            rel_path="p", page_txt="needle", owner=self.owner, group=self.group, other_perms_read=False, creation_time=dtm, modified_time=dtm
+        ).save()
+        self.model_admin = PikiPageAdmin(PikiPage, admin.site)
+        patcher = mock.patch.object(PikiPageAdmin, "message_user")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, user, **post):
+        request = RequestFactory().post("/admin/", post) if post else RequestFactory().get("/page/p")
+        request.user = user
+        return request
+
+    def meta(self, user):
+        return PikiPage.objects.get(rel_path="p").render_meta(self.request(user), None)
+
+    def test_set_group_invalidates_the_meta_page(self):
+        self.assertIn("|Group:|team|", self.meta(self.owner))
+        self.model_admin.set_group(self.request(self.owner, apply="1", group=""), PikiPage.objects.filter(rel_path="p"))
+        self.assertIn("|Group:|---|", self.meta(self.owner))
+
+    def test_set_group_revokes_access(self):
+        dtm = datetime.now(ZoneInfo("UTC"))
+        PikiPage(rel_path="list", page_txt="<<allpages>>", creation_time=dtm, modified_time=dtm).save()
+        with parameters(SEARCH_BACKEND="fts5"), mock.patch.dict(search._backends, clear=True):
+            search.rebuild_index(create_index())
+            self.client.force_login(self.member)
+
+            def visible():
+                with mock.patch.object(mycreole, "render", render_macros):
+                    listing = PikiPage.objects.get(rel_path="list").render_to_html(self.request(self.member))
+                hits = [rel_path for rel_path, highlights in search_page(self.request(self.member), "needle")]
+                meta = self.client.get(url_page("p", meta=None)).content.decode("utf-8")
+                return [url_page("p") in listing, hits == ["p"], "Group:" in meta]
+
+            self.assertEqual(visible(), [True, True, True])
+            self.model_admin.set_group(self.request(self.owner, apply="1", group=""), PikiPage.objects.filter(rel_path="p"))
+            self.assertEqual(visible(), [False, False, False])
+
+
+class PermissionProfileTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        self.user = User.objects.create(username="user")
+        self.group = Group.objects.create(name="group")
+        PikiPage(rel_path="a", page_txt="", group=self.group, group_perms_read=True, other_perms_read=False, creation_time=dtm, modified_time=dtm).save()
+
+    def request(self):
+        request = RequestFactory().get("/page/a")
+        request.user = self.user
+        return request
+
+    def test_profile_is_cached(self):
+        permission_profile(self.request())
+        with self.assertNumQueries(0):
+            self.assertEqual(permission_profile(self.request())["group_ids"], frozenset())
+
+    def test_group_changes_invalidate_the_profile(self):
+        self.assertFalse(access_control(self.request(), "a").may_read())
+        self.user.groups.add(self.group)
+        self.assertTrue(access_control(self.request(), "a").may_read())
+        self.group.user_set.clear()
+        self.assertFalse(access_control(self.request(), "a").may_read())
+        self.group.user_set.add(self.user)
+        self.assertTrue(access_control(self.request(), "a").may_read())
+        self.group.delete()
+        self.assertEqual(permission_profile(self.request())["group_ids"], frozenset())
+
+
+class ReadablePagesTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        self.owner = User.objects.create(username="owner")
+        self.member = User.objects.create(username="member")
+        self.other = User.objects.create(username="other")
+        group = Group.objects.create(name="group")
+        self.member.groups.add(group)
+        for index in range(8):
+            PikiPage(
+                rel_path="p%d" % index, page_txt="", owner=self.owner, group=group,
+                owner_perms_read=bool(index & 1), group_perms_read=bool(index & 2), other_perms_read=bool(index & 4),
+                creation_time=dtm, modified_time=dtm
+            ).save()
+
+    def request(self, user):
+        request = RequestFactory().get("/page/p0")
+        request.user = user
+        return request
+
+    def test_same_result_as_access_control(self):
+        for user in [self.owner, self.member, self.other, AnonymousUser()]:
+            expected = set(page.rel_path for page in PikiPage.objects.all() if access_control(self.request(user), page.rel_path).may_read())
+            readable = set(readable_pages(self.request(user), PikiPage.objects.all()).values_list("rel_path", flat=True))
+            self.assertEqual(readable, expected)
+
+    def test_listing_macro(self):
+        page = PikiPage(rel_path="list")
+        page._render_request = self.request(AnonymousUser())
+        html = page.macro_allpages()
+        self.assertNotIn("p3", html)
+        self.assertIn("p4", html)
+
+    def test_revoked_read_access(self):
+        request = self.request(AnonymousUser())
+        dtm = datetime.now(ZoneInfo("UTC"))
+        list_page = PikiPage(rel_path="list", page_txt="<<allpages>>", creation_time=dtm, modified_time=dtm)
+        list_page.save()
+        with mock.patch.object(mycreole, "render", render_macros):
+            self.assertIn("p4", list_page.render_to_html(request))
+        self.assertEqual(complete(request, "p4"), ["p4"])
+        #
+        page = PikiPage.objects.get(rel_path="p4")
+        page.other_perms_read = False
+        page.save()
+        self.assertFalse(PikiPage.objects.get(rel_path="p4").other_perms_read)
+        request = self.request(AnonymousUser())
+        with mock.patch.object(mycreole, "render", render_macros):
+            self.assertNotIn("p4", PikiPage.objects.get(rel_path="list").render_to_html(request))
+        self.assertEqual(complete(request, "p4"), [])
+
+
+class AutocompleteTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        self.owner = User.objects.create(username="owner")
+        for rel_path in ["Ops/Backup", "ops/deploy", "team/ops", "team/Operations", "other"]:
+            PikiPage(rel_path=rel_path, page_txt="", owner=self.owner, creation_time=dtm, modified_time=dtm).save()
+        PikiPage(rel_path="ops/secret", page_txt="", owner=self.owner, other_perms_read=False, creation_time=dtm, modified_time=dtm).save()
+        self.request = RequestFactory().get("/autocomplete/")
+        self.request.user = AnonymousUser()
+
+    def test_path_and_title_prefix(self):
+        self.assertEqual(complete(self.request, "ops"), ["Ops/Backup", "ops/deploy", "team/ops"])
+        self.assertEqual(complete(self.request, "oper"), ["team/Operations"])
+        self.assertEqual(complete(self.request, "OPS/D"), ["ops/deploy"])
+        self.assertEqual(complete(self.request, "ops", 2), ["Ops/Backup", "ops/deploy"])
+
+    def test_only_readable_pages(self):
+        self.assertNotIn("ops/secret", complete(self.request, "ops/"))
+        request = RequestFactory().get("/autocomplete/")
+        request.user = self.owner
+        self.assertIn("ops/secret", complete(request, "ops/"))
+
+    def test_changes(self):
+        complete(self.request, "ops")
+        with self.assertNumQueries(0):
+            complete(self.request, "ops")
+        page = PikiPage.objects.get(rel_path="ops/deploy")
+        page.rel_path = "ops/release"
+        page.save()
+        self.assertEqual(complete(self.request, "ops/"), ["Ops/Backup", "ops/release"])
+        PikiPage.objects.get(rel_path="Ops/Backup").delete()
+        self.assertEqual(complete(self.request, "ops/"), ["ops/release"])
+
+    def test_changes_are_applied(self):
+        complete(self.request, "ops")
+        with mock.patch.object(autocomplete.path_index, "build") as build:
+            page = PikiPage.objects.get(rel_path="ops/deploy")
+            page.rel_path = "team/deploy"
+            page.save()
+            PikiPage.objects.filter(rel_path="ops/secret").update(other_perms_read=True)
+            cache.invalidate_dependents(["ops/secret"])
+            PikiPage.objects.get(rel_path="other").delete()
+            self.assertEqual(complete(self.request, "ops/"), ["Ops/Backup", "ops/secret"])
+            self.assertEqual(complete(self.request, "deploy"), ["team/deploy"])
+            self.assertEqual(complete(self.request, "oth"), [])
+            build.assert_not_called()
+
+    def test_pruned_changes(self):
+        complete(self.request, "ops")
+        ListingChange.objects.all().delete()
+        page = PikiPage.objects.get(rel_path="ops/deploy")
+        page.deleted = True
+        page.save()
+        build = autocomplete.path_index.build
+        with mock.patch.object(autocomplete.path_index, "build", autospec=True, side_effect=build) as build:
+            self.assertEqual(complete(self.request, "ops/"), ["Ops/Backup"])
+            build.assert_called_once()
+
+
+class SubtreeSearchTests(PikiTestCase):
+    backend = "fts5"
+
+    def setUp(self):
+        super().setUp()
+        # the index of the installation must not be touched, even if another backend is used by mistake
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        settings_override = override_settings(WHOOSH_PATH=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.path = path
+        for patcher in [parameters(SEARCH_BACKEND=self.backend, SEARCH_INDEX_ASYNC=False), mock.patch.dict(search._backends, clear=True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.assertEqual(search.get_backend().name, self.backend)
+        dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        for rel_path in ["team", "team/ops", "team/ops/deploy", "team/opsfoo"]:
+            PikiPage(rel_path=rel_path, page_txt="needle", creation_time=dtm, modified_time=dtm).save()
+        search.rebuild_index(create_index())
+        self.request = RequestFactory().get("/search/")
+        self.request.user = AnonymousUser()
+
+    def test_ancestor_paths(self):
+        self.assertEqual(ancestor_paths("team/ops/deploy"), ["team", "team/ops", "team/ops/deploy"])
+
+    def test_subtree(self):
+        result = search_page(self.request, "needle", path="team/ops/")
+        self.assertEqual(sorted(rel_path for rel_path, highlights in result), ["team/ops", "team/ops/deploy"])
+        self.assertEqual(len(search_page(self.request, "needle path:team")), 4)
+
+
+class WhooshSubtreeSearchTests(SubtreeSearchTests):
+    backend = "whoosh"
+
+    def test_outdated_schema(self):
+        # index of a version without the path field
+        old_schema = Schema(**{name: field for name, field in search.SCHEMA.items() if name != "path"})
+        ix = whoosh_index.create_in(self.path, schema=old_schema)
+        with ix.writer() as w:
+            w.add_document(id="team/ops", title="ops", page_src="needle")
+        search._backends.clear()
+        self.assertFalse(search.schema_outdated(search.load_index()))
+        search.queue_update("team/ops")
+        self.test_subtree()
+
+
+class RebuildIndexCommandTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        settings_override = override_settings(WHOOSH_PATH=path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for patcher in [parameters(SEARCH_BACKEND="whoosh"), mock.patch.dict(search._backends, clear=True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        for rel_path in ["a", "b", "c"]:
+            PikiPage(rel_path=rel_path, page_txt="needle", creation_time=self.dtm, modified_time=self.dtm).save()
+        self.call("--procs", "1")
+        # the pages are changed without updating the index (as done by the views)
+        a = PikiPage.objects.get(rel_path="a")
+        a.page_txt = "haystack"
+        a.modified_time = self.dtm + timedelta(days=1)
+        a.save()
+        b = PikiPage.objects.get(rel_path="b")
+        b.deleted = True
+        b.save()
+        PikiPage(rel_path="d", page_txt="needle", creation_time=self.dtm, modified_time=self.dtm).save()
+
+    def call(self, *args):
+        stdout = StringIO()
+        call_command("rebuild_index", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def hits(self, search_txt):
+        backend = search.get_backend()
+        return sorted(rel_path for rel_path, hit in backend.search(backend.load_index(), parse_query(search_txt), None))
+
+    def test_check(self):
+        output = self.call("--check")
+        for line in ["missing: d", "outdated: a", "obsolete: b", "(1 missing, 1 outdated, 1 obsolete)"]:
+            self.assertIn(line, output)
+        # the index is not changed
+        self.assertEqual(self.hits("needle"), ["a", "b", "c"])
+        self.assertIn("(1 missing, 1 outdated, 1 obsolete)", self.call("--check"))
+
+    def test_incremental(self):
+        self.assertIn("synchronised", self.call("--incremental"))
+        self.assertEqual(self.hits("needle"), ["c", "d"])
+        self.assertEqual(self.hits("haystack"), ["a"])
+        self.assertEqual(search.index_drift(search.load_index()), ([], [], []))
+        self.assertIn("(0 missing, 0 outdated, 0 obsolete)", self.call("--check"))
+
+
+class FtsTranslationTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        for patcher in [parameters(SEARCH_BACKEND="fts5", SEARCH_INDEX_ASYNC=False), mock.patch.dict(search._backends, clear=True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.backend = fts5_backend()
+        dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        for i, (rel_path, page_txt) in enumerate([("alpha", "foobar baz"), ("beta", "fo7bar qux"), ("gamma", "foo bar baz")]):
+            PikiPage(rel_path=rel_path, page_txt=page_txt, creation_time=dtm, modified_time=dtm + timedelta(days=i)).save()
+        self.backend.rebuild_index(self.backend.create_index())
+
+    def hits(self, search_txt):
+        return sorted(rel_path for rel_path, hit in self.backend.search(None, parse_query(search_txt), None))
+
+    def test_and_mixes_match_and_sql(self):
+        q = query.And([query.Term("title", "a"), query.Term("id", "x"), query.Term("page_src", "b")])
+        self.assertEqual(self.backend.translate(q), ['(title : "a") AND (page_src : "b")', "(p.rel_path = %s)", ["x"]])
+        self.assertEqual(self.hits("baz AND NOT title:gamma"), ["alpha"])
+
+    def test_or_mixes_match_and_sql(self):
+        match = "p.id IN (SELECT rowid FROM pages_fts WHERE pages_fts MATCH %s)"
+        q = query.Or([query.Term("title", "a"), query.Term("page_src", "b")])
+        self.assertEqual(self.backend.translate(q), ['(title : "a") OR (page_src : "b")', None, []])
+        q = query.Or([query.Term("title", "a"), query.Term("id", "x")])
+        self.assertEqual(self.backend.translate(q), [None, f"({match}) OR ((p.rel_path = %s))", ['title : "a"', "x"]])
+        self.assertEqual(self.backend.translate(query.Not(query.Term("title", "a"))), [None, f"NOT ({match})", ['title : "a"']])
+        self.assertEqual(self.hits("qux OR id:alpha"), ["alpha", "beta"])
+        self.assertEqual(self.hits("baz NOT (qux OR id:alpha)"), ["gamma"])
+
+    def test_date_range(self):
+        match, sql, params = self.backend.translate(parse_query("modified_time:[20240102 to]"))
+        self.assertEqual([match, sql, len(params)], [None, "p.modified_time >= %s", 1])
+        self.assertEqual(self.hits("modified_time:[20240102 to]"), ["beta", "gamma"])
+        self.assertEqual(self.hits("modified_time:[to 20240102]"), ["alpha", "beta"])
+        self.assertEqual(self.hits("baz modified_time:[20240102 to 20240103]"), ["gamma"])
+
+    def test_every_and_null_query(self):
+        self.assertEqual(self.backend.translate(query.Every()), [None, None, []])
+        self.assertEqual(self.backend.translate(query.NullQuery), [None, "0", []])
+        self.assertEqual(self.backend.translate(query.And([query.Term("title", "a"), query.NullQuery])), ['(title : "a")', "(0)", []])
+        self.assertEqual(self.hits("*"), ["alpha", "beta", "gamma"])
+
+    def test_wildcard(self):
+        self.assertEqual(
+            self.backend.translate(query.Wildcard("page_src", "fo?b*")),
+            ['page_src : "fo" *', "pages_fts.page_src REGEXP %s", ["(?i)(?<!\\w)fo\\w" "b\\w*(?!\\w)"]]
+        )
+        self.assertEqual(self.hits("fo?bar"), ["alpha", "beta"])
+        self.assertEqual(self.hits("*bar"), ["alpha", "beta", "gamma"])
+        self.assertEqual(self.hits("f*r NOT qux"), ["alpha"])
+
+    def test_unsupported_query(self):
+        with self.assertLogs(level="INFO"):
+            self.assertIsNone(self.backend.search(None, parse_query("title:[alpha TO beta]"), None))
+
+
+class WhooshBackendTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.backend = whoosh_backend(path=path)
+        self.ix = self.backend.create_index()
+        dtm = datetime.now(ZoneInfo("UTC"))
+        self.page = PikiPage(rel_path="a", page_txt="apple", creation_time=dtm, modified_time=dtm)
+        self.page.save()
+        self.backend.add_item(self.ix, self.page)
+
+    def test_index_version_is_throttled(self):
+        version = self.backend.index_version(self.ix)
+        with mock.patch.object(self.backend, "read_index_version") as read_index_version:
+            for index in range(10):
+                self.assertEqual(self.backend.index_version(self.ix), version)
+            read_index_version.assert_not_called()
+        # own changes are seen immediately
+        self.backend.delete_item(self.ix, self.page)
+        self.assertNotEqual(self.backend.index_version(self.ix), version)
+
+    def test_outdated_searchers_are_closed(self):
+        searcher = self.backend.get_searcher(self.ix)
+        self.assertIs(self.backend.get_searcher(self.ix), searcher)
+        self.backend.delete_item(self.ix, self.page)
+        self.assertIsNot(self.backend.get_searcher(self.ix), searcher)
+        self.assertTrue(searcher.is_closed)
+        # the searcher of a finished thread
+        searchers = []
+        thread = threading.Thread(target=lambda: searchers.append(self.backend.get_searcher(self.ix)))
+        thread.start()
+        thread.join()
+        self.backend.add_item(self.ix, self.page)
+        self.backend.get_searcher(self.ix)
+        self.assertTrue(searchers[0].is_closed)
+        self.assertEqual(len(self.backend._searchers), 1)
+
+
+class SearchIndexQueueTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = mock.Mock(transactional=False)
+        for patcher in [mock.patch.object(search, "get_backend", return_value=self.backend), parameters(SEARCH_INDEX_ASYNC=True)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def queued(self):
+        return set(SearchIndexQueue.objects.values_list("rel_path", flat=True))
+
+    def test_enqueue(self):
+        with mock.patch.object(search, "wake_worker") as wake_worker:
+            with self.captureOnCommitCallbacks(execute=True):
+                search.queue_update("a", "b")
+                search.queue_update("a")
+            wake_worker.assert_called()
+        self.assertEqual(SearchIndexQueue.objects.count(), 2)
+        self.assertEqual(self.queued(), {"a", "b"})
+        self.backend.index_pages.assert_not_called()
+
+    def test_drain(self):
+        search.queue_update("a", "b", "c")
+        self.assertEqual(search.process_queue(batch_size=2), 2)
+        self.assertEqual(search.process_queue(batch_size=2), 1)
+        self.assertEqual(search.process_queue(batch_size=2), 0)
+        self.assertEqual(self.queued(), set())
+        self.assertEqual(sorted(sum([call.args[1] for call in self.backend.index_pages.call_args_list], [])), ["a", "b", "c"])
+
+    def test_retry_after_lock_failure(self):
+        search.queue_update("a")
+        worker = search.index_worker()
+        self.backend.index_pages.side_effect = LockError()
+        with mock.patch.object(search, "connection"):
+            self.assertEqual(worker.process(), search.QUEUE_RETRY_INTERVAL)
+            self.assertEqual(self.queued(), {"a"})
+            self.backend.index_pages.side_effect = None
+            self.assertEqual(worker.process(), search.QUEUE_POLL_INTERVAL)
+        self.assertEqual(self.queued(), set())
+
+    def test_indexing_error(self):
+        self.backend.index_pages.side_effect = ValueError()
+        search.queue_update("a")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(search.process_queue(), 1)
+        self.assertEqual(self.queued(), set())
+        # the page is saved anyway
+        with parameters(SEARCH_INDEX_ASYNC=False), self.assertLogs(level="ERROR"):
+            search.queue_update("a")
+        self.assertEqual(self.queued(), set())
+
+    def test_locked_index_without_worker(self):
+        self.backend.index_pages.side_effect = LockError()
+        with parameters(SEARCH_INDEX_ASYNC=False), mock.patch.object(search, "wake_worker"):
+            search.queue_update("a")
+        self.assertEqual(self.queued(), {"a"})
+
+
+class SearchPageTests(PikiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = mock.Mock(transactional=False)
+        for patcher in [mock.patch.object(search, "get_backend", return_value=self.backend), mock.patch.object(search, "start_queue_worker")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_page_size_is_clamped(self):
+        self.backend.configure_mock(name="test", **{"index_version.return_value": 1, "search.return_value": []})
+        request = RequestFactory().get("/search/")
+        request.user = AnonymousUser()
+        rv = search_page(request, "apple", page_size=10 ** 9)
+        self.assertEqual(rv.page_size, search.SEARCH_MAX_PAGE_SIZE)
+        self.assertEqual(self.backend.search.call_args.args[2], search.SEARCH_MAX_PAGE_SIZE + 1)
+
+    def search(self, search_txt):
+        request = RequestFactory().get("/search/")
+        request.user = AnonymousUser()
+        return search_page(request, search_txt)
+
+    def test_results_are_cached(self):
+        dtm = datetime(2024, 1, 1, tzinfo=ZoneInfo("UTC"))
+        PikiPage(rel_path="p", page_txt="apple", creation_time=dtm, modified_time=dtm).save()
+        self.backend.configure_mock(
+            name="test", **{"index_version.return_value": 1, "search.return_value": [["p", "hit"]], "highlights.return_value": "hit"}
+        )
+        self.assertEqual(self.search("apple"), [["p", "hit"]])
+        self.assertEqual(self.search("apple"), [["p", "hit"]])
+        self.assertEqual(self.backend.search.call_count, 1)
+        # a change of the index
+        self.backend.index_version.return_value = 2
+        self.search("apple")
+        self.assertEqual(self.backend.search.call_count, 2)
+        # a change of the readable pages
+        cache.renew_listing_token()
+        self.search("apple")
+        self.assertEqual(self.backend.search.call_count, 3)
+        self.search("apple")
+        self.assertEqual(self.backend.search.call_count, 3)
+
+    def test_relative_queries_expire(self):
+        self.backend.configure_mock(name="test", **{"index_version.return_value": 1, "search.return_value": []})
+        search_cache = caches[cache.SEARCH_CACHE_NAME]
+        with mock.patch.object(search_cache, "set", wraps=search_cache.set) as cache_set:
+            self.search("apple")
+            self.assertNotIn("timeout", cache_set.call_args.kwargs)
+            self.search("modified_time:[-5d to now]")
+            self.assertEqual(cache_set.call_args.kwargs["timeout"], cache.SEARCH_RELATIVE_TIMEOUT)
@@ -1,23 +1,24 @@
 from django.conf import settings
 from django.contrib import messages as django_messages
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.utils.translation import gettext as _
 
 import logging
 
 
 from .access import access_control
+from .autocomplete import AUTOCOMPLETE_SIZE, AUTOCOMPLETE_MAX_SIZE, complete
 from . import messages
 from . import url_page
-from . import get_search_query
+from . import get_search_query, get_int_param
 import config
 from .context import context_adaption
 from .forms import EditForm, RenameForm
 from .help import help_pages
-from .models import PikiPage, page_list
+from .models import PikiPage, get_page
 import mycreole
-from .search import whoosh_search, load_index, delete_item, add_item, update_item
+from .search import SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, queue_update, search_page, search_result
 from themes import Context
 
 logger = logging.getLogger(settings.ROOT_LOGGER_NAME).getChild(__name__)
@@ -41,10 +42,7 @@ def root(request):
 def page(request, rel_path):
     context = Context(request)      # needs to be executed first because of time mesurement
     #
-    try:
-        p = PikiPage.objects.get(rel_path=rel_path)
-    except PikiPage.DoesNotExist:
-        p = None
+    p = get_page(request, rel_path)
     meta = "meta" in request.GET
     history = request.GET.get("history")
     if history:
@@ -93,18 +91,16 @@ def edit(request, rel_path):
     if acc.may_write():
         context = Context(request)      # needs to be executed first because of time mesurement
         #
-        try:
-            p = PikiPage.objects.get(rel_path=rel_path)
-            is_available = True
-        except PikiPage.DoesNotExist:
+        p = get_page(request, rel_path)
+        is_available = p is not None
+        if not is_available:
             p = PikiPage(rel_path=rel_path)
-            is_available = False
         #
         if not request.POST:
             history = request.GET.get("history")
             if history:
                 history = int(history)
-                form = EditForm(instance=p.history.get(history_id=history))
+                form = EditForm(instance=p.get_history(history))
             else:
                 form = EditForm(instance=p)
             #
@@ -133,7 +129,7 @@ def edit(request, rel_path):
                     if page.save_needed:
                         messages.edit_success(request)
                         # update search index
-                        update_item(page)
+                        queue_update(page.rel_path)
                     else:
                         messages.no_change(request)
                 else:
@@ -165,12 +161,10 @@ def delete(request, rel_path):
     if acc.may_write():
         context = Context(request)      # needs to be executed first because of time mesurement
         #
-        try:
-            p = PikiPage.objects.get(rel_path=rel_path)
-            is_available = True
-        except PikiPage.DoesNotExist:
+        p = get_page(request, rel_path)
+        is_available = p is not None
+        if not is_available:
             p = PikiPage(rel_path=rel_path)
-            is_available = False
         #
         if not request.POST:
             #
@@ -194,8 +188,7 @@ def delete(request, rel_path):
                 p.deleted = True
                 p.save()
                 # delete page from search index
-                ix = load_index()
-                delete_item(ix, p)
+                queue_update(p.rel_path)
                 # add delete message
                 messages.page_deleted(request, p.title)
                 return HttpResponseRedirect("/")
@@ -213,12 +206,10 @@ def rename(request, rel_path):
     if acc.may_write():
         context = Context(request)      # needs to be executed first because of time mesurement
         #
-        try:
-            p = PikiPage.objects.get(rel_path=rel_path)
-            is_available = True
-        except PikiPage.DoesNotExist:
+        p = get_page(request, rel_path)
+        is_available = p is not None
+        if not is_available:
             p = PikiPage(rel_path=rel_path)
-            is_available = False
         #
         if not request.POST:
             form = RenameForm(page_name=p.rel_path)
@@ -242,14 +233,12 @@ def rename(request, rel_path):
                 if page_name == p.rel_path:
                     messages.no_change(request)
                 else:
-                    # delete page from search index
-                    ix = load_index()
-                    delete_item(ix, p)
+                    old_rel_path = p.rel_path
                     # rename the storage folder
                     p.rel_path = page_name
                     p.save()
-                    # add the renamed page to the search index
-                    add_item(ix, p)
+                    # move the page in the search index
+                    queue_update(old_rel_path, p.rel_path)
                     # add rename message
                     messages.page_renamed(request)
             else:
@@ -266,24 +255,36 @@ def search(request):
     #
     search_txt = get_search_query(request)
 
-    sr = whoosh_search(search_txt)
+    page_num = max(get_int_param(request, "page", 1), 1)
+    page_size = min(max(get_int_param(request, "size", SEARCH_PAGE_SIZE), 1), SEARCH_MAX_PAGE_SIZE)
+    path = request.GET.get("path")
+    sr = search_page(request, search_txt, page_num, page_size, path)
     if sr is None:
         django_messages.error(request, _('Invalid search pattern: %s') % repr(search_txt))
-        sr = []
-    if len(sr) == 1:
-        return HttpResponseRedirect(url_page(sr[0]))
+        sr = search_result(search_txt, page_num, page_size, False, path)
+    if page_num == 1 and len(sr) == 1 and not sr.more:
+        return HttpResponseRedirect(url_page(sr[0][0]))
     else:
-        pl = page_list([PikiPage.objects.get(rel_path=rel_path) for rel_path in set(sr)])
         #
         context_adaption(
             context,
             request,
-            title=_("Searchresults"),
-            page_content=mycreole.render_simple(pl.creole_list())
+            title=_("Searchresults") if sr.path is None else _("Searchresults in %s") % repr(sr.path),
+            page_content=sr.html()
         )
         return render(request, 'pages/page.html', context=context)
 
 
+def autocomplete(request):
+    prefix = get_search_query(request) or ""
+    size = min(max(get_int_param(request, "size", AUTOCOMPLETE_SIZE), 1), AUTOCOMPLETE_MAX_SIZE)
+    results = [
+        {"rel_path": rel_path, "title": rel_path.split("/")[-1], "url": url_page(rel_path)}
+        for rel_path in complete(request, prefix, size)
+    ]
+    return JsonResponse({"q": prefix, "results": results})
+
+
 def helpview(request, page='main'):
     context = Context(request)      # needs to be executed first because of time mesurement
     page_content = help_pages[page]
@@ -36,6 +36,7 @@ urlpatterns = [
     path('helpview/<str:page>', pages.views.helpview, name='page-helpview'),
     # theme
     path('search/', pages.views.search, name='search'),
+    path('autocomplete/', pages.views.autocomplete, name='page-autocomplete'),
     # mycreole
     path('mycreole/', include('mycreole.urls')),
     # users